@@ -0,0 +1,200 @@
+import asyncio
+import serial
+import struct
+import time
+from typing import Tuple, List, Optional
+
+from one_wire_metrics import OneWireMetrics
+from one_wire_packet import OneWirePacket
+from one_wire_parser import OneWireFrameParser
+from one_wire_python import (OneWireMasterInterface, OneWireException,
+                             OneWireTimeout, OneWireChecksumError,
+                             OneWireComError, ONE_WIRE_BROADCAST_ID)
+
+
+class AsyncOneWireMasterInterface:
+    """ asyncio counterpart of OneWireMasterInterface
+
+        Incoming bytes are consumed by a non-blocking reader registered on the
+        event loop, which resolves the future of the pending request matching
+        the ID of each status packet. Every request has its own deadline
+        (the 'timeout' argument, or the default timeout of the interface).
+        The bus being half-duplex, requests are still sent one at a time.
+        Transactions go through the same hooks and metrics as with
+        OneWireMasterInterface. If the port fails, the reader is removed,
+        the port closed and every pending request fails with an IOError.
+    """
+    Instructions = OneWireMasterInterface.Instructions
+    _notifyAnswer = OneWireMasterInterface._notifyAnswer
+    _notifyError = OneWireMasterInterface._notifyError
+
+    def __init__(self, port="", baudrate=400000, timeout=0.1):
+        self.serial = serial.Serial()
+        self.serial.port = port
+        self.serial.baudrate = baudrate
+        self.serial.timeout = 0  # non-blocking reads
+        assert timeout is not None
+        self.timeout = timeout
+        self._loop = None
+        self._lock = None
+        self._poll_task = None
+        self._fd = None  # file descriptor watched by the event loop
+        self.parser = OneWireFrameParser(self._onChecksumError)
+        self._pending = {}
+        # See OneWireMasterInterface
+        self.pre_send_hooks = []
+        self.post_receive_hooks = []
+        self.error_hooks = []
+        self.metrics = OneWireMetrics(
+            {v: k for k, v in self.Instructions.items()})  # None disables
+
+    async def open(self, port=None, baudrate=None, timeout=None):
+        if port is not None:
+            self.serial.port = port
+        if baudrate is not None:
+            self.serial.baudrate = baudrate
+        if timeout is not None:
+            self.timeout = timeout
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self.serial.open()
+        try:
+            self._loop.add_reader(self.serial.fileno(), self._onReadable)
+            self._fd = self.serial.fileno()
+        except (NotImplementedError, AttributeError):
+            # Event loop or platform without file descriptor watching
+            self._poll_task = self._loop.create_task(self._pollLoop())
+
+    def close(self):
+        self._stopReading()
+        self.serial.close()
+        self._failPending(OneWireTimeout())
+
+    def isOpen(self):
+        return self.serial.isOpen()
+
+    async def readU8(self, device_id: int, addr: int, timeout: Optional[float] = None) -> Tuple[int, int]:
+        return await self._read(device_id, addr, "<B", timeout)
+
+    async def readU16(self, device_id: int, addr: int, timeout: Optional[float] = None) -> Tuple[int, int]:
+        return await self._read(device_id, addr, "<H", timeout)
+
+    async def readU32(self, device_id: int, addr: int, timeout: Optional[float] = None) -> Tuple[int, int]:
+        return await self._read(device_id, addr, "<I", timeout)
+
+    async def readBlock(self, device_id: int, addr: int, length: int, timeout: Optional[float] = None) -> Tuple[int, bytes]:
+        p = OneWireMasterInterface._readRequest(device_id, addr, length)
+        err, data = await self._transaction(p, True, timeout)
+        return err, OneWireMasterInterface._checkReadAnswer(data, length)
+
+    async def writeU8(self, device_id: int, addr: int, data: int, expect_answer: bool = True,
+                      timeout: Optional[float] = None) -> Optional[int]:
+        return await self._write(device_id, addr, data, "<B", expect_answer, timeout)
+
+    async def writeU16(self, device_id: int, addr: int, data: int, expect_answer: bool = True,
+                       timeout: Optional[float] = None) -> Optional[int]:
+        return await self._write(device_id, addr, data, "<H", expect_answer, timeout)
+
+    async def writeU32(self, device_id: int, addr: int, data: int, expect_answer: bool = True,
+                       timeout: Optional[float] = None) -> Optional[int]:
+        return await self._write(device_id, addr, data, "<I", expect_answer, timeout)
+
+    async def syncWrite(self, id_list: List[int], addr: int, data_list: List[bytes]) -> None:
+        p = OneWireMasterInterface._syncWriteRequest(id_list, addr, data_list)
+        await self._transaction(p, False, None)
+
+    async def ping(self, device_id: int, timeout: Optional[float] = None) -> int:
+        p = OneWirePacket(device_id, self.Instructions["PING"])
+        return (await self._transaction(p, True, timeout))[0]
+
+    async def _read(self, device_id: int, addr: int, data_format: str, timeout: Optional[float]) -> Tuple[int, int]:
+        err, data = await self.readBlock(device_id, addr, struct.calcsize(data_format), timeout)
+        return err, OneWireMasterInterface._unpack(data, data_format)
+
+    async def _write(self, device_id: int, addr: int, data: int, data_format: str, expect_answer: bool,
+                     timeout: Optional[float]) -> Optional[int]:
+        p = OneWireMasterInterface._writeRequest(device_id, addr, struct.pack(data_format, data))
+        err, _ = await self._transaction(p, expect_answer, timeout)
+        if expect_answer:
+            return err
+        else:
+            return None
+
+    async def _transaction(self, packet: OneWirePacket, expect_answer: bool,
+                           timeout: Optional[float]) -> Tuple[int, bytes]:
+        if timeout is None:
+            timeout = self.timeout
+        expect_answer = expect_answer and packet.id != ONE_WIRE_BROADCAST_ID
+        async with self._lock:
+            future = None
+            if expect_answer:
+                future = self._loop.create_future()
+                self._pending[packet.id] = future
+            frame = packet.toFrame()
+            for hook in self.pre_send_hooks:
+                hook(packet.id, packet.instruction, frame)
+            start = time.monotonic()
+            try:
+                self.serial.write(frame)
+                if future is None:
+                    err, data = 0, bytes()
+                else:
+                    try:
+                        err, data = await asyncio.wait_for(future, timeout)
+                    except asyncio.TimeoutError:
+                        raise OneWireTimeout
+            except (OneWireException, IOError) as e:
+                self._notifyError(packet.id, packet.instruction, e,
+                                  time.monotonic() - start)
+                raise
+            finally:
+                self._pending.pop(packet.id, None)
+            self._notifyAnswer(packet.id, packet.instruction, err, data,
+                               time.monotonic() - start)
+            return err, data
+
+    def _onReadable(self):
+        try:
+            data = self.serial.read(max(1, self.serial.in_waiting))
+        except OSError as e:  # SerialException, or EIO from in_waiting
+            # A dead port stays readable: stop watching it
+            self._stopReading()
+            self.serial.close()
+            self._failPending(IOError(e))
+            return
+        for frame in self.parser.feed(data):
+            future = self._pending.get(frame.id)
+            if future is None:
+                # Answer of another device, as in OneWireMasterInterface
+                self._failPending(OneWireComError())
+            elif not future.done():
+                future.set_result((frame.instruction, frame.data))
+
+    def _stopReading(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        elif self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        self._fd = None
+
+    def _failPending(self, error: Exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    def _onChecksumError(self, device_id: int):
+        future = self._pending.get(device_id)
+        if future is not None and not future.done():
+            future.set_exception(OneWireChecksumError())
+
+    async def _pollLoop(self):
+        while True:
+            try:
+                waiting = self.serial.in_waiting
+            except OSError:
+                waiting = 1  # _onReadable() handles the failure
+            if waiting > 0:
+                self._onReadable()
+            await asyncio.sleep(0.0005)
@@ -0,0 +1,226 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from os.path import dirname, abspath
+
+from one_wire_def import OW_BAUDRATE
+from one_wire_python import OneWireException
+from one_wire_simulator import VirtualOneWireDevice, create_virtual_interface
+from one_wire_timing import (transaction_time, read_transaction_time,
+                             OW_STATUS_OVERHEAD, OW_MAX_RETURN_DELAY_TIME)
+from one_wire_scanner import OW_PING_REQUEST_SIZE
+from reg_map.reg_map import (get_register_map_list, get_register_area_span,
+                             decode_register_area)
+
+"""
+Benchmark of OneWireMasterInterface against the virtual bus.
+
+Each workload is run at each baudrate and reports:
+- p50/p99 latency of one transaction (s);
+- transactions per second;
+- bus utilization: theoretical bus time of the transactions (scaled like the
+  virtual bus timing) / wall time;
+- errors: transactions which raised a OneWireException;
+- allocations_per_tx: memory blocks allocated during a second, traced, run
+  (sum of the positive count differences between tracemalloc snapshots
+  taken before and after it) per transaction; objects freed before the end
+  of the run are not seen, hence:
+- transient_bytes_per_tx: mean of the peak of the memory traced during each
+  transaction of that run, above the memory traced before it;
+- peak_bytes: peak of the memory traced by tracemalloc during that run.
+"""
+
+HOST_OVERHEAD = 0.005
+
+
+class Workload:
+    def __init__(self, name, run, bus_time):
+        self.name = name
+        self.run = run  # callable(i) -> None, one transaction
+        self.bus_time = bus_time  # callable(baudrate) -> seconds
+
+
+def make_workloads(ow, devices, register_map, timeout):
+    ids = [d.id for d in devices]
+    ram = register_map[2]
+    ram_start, ram_length = get_register_area_span(ram)
+    goal = ram[0]
+    n = len(ids)
+
+    def ping(i):
+        ow.ping(ids[i % n])
+
+    def read(i):
+        ow.readU16(ids[i % n], ram_start)
+
+    def block_read(i):
+        _, data = ow.readBlock(ids[i % n], ram_start, ram_length)
+        decode_register_area(ram, ram_start, data)
+
+    def sync_write(i):
+        ow.syncWrite(ids, goal[0],
+                     [(i % 2).to_bytes(goal[1], 'little')] * n)
+        ow.serial.flush()  # wait for the end of the transmission
+
+    def scan(i):
+        try:
+            ow.ping(200 + i % 50)  # no device at these IDs
+        except OneWireException:
+            pass
+
+    return [
+        Workload("ping", ping, lambda b: transaction_time(
+            OW_PING_REQUEST_SIZE, OW_STATUS_OVERHEAD, b)),
+        Workload("read", read, lambda b: read_transaction_time(2, b)),
+        Workload("block_read", block_read,
+                 lambda b: read_transaction_time(ram_length, b)),
+        Workload("sync_write", sync_write, lambda b: transaction_time(
+            8 + (goal[1] + 1) * n, 0, b)),
+        Workload("scan", scan, lambda b: timeout),
+    ]
+
+
+def percentile(sorted_values, p):
+    if len(sorted_values) == 0:
+        return None
+    k = min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def run_workload(w, baudrate, iterations, time_scale):
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        try:
+            w.run(i)
+        except OneWireException:
+            errors += 1
+        latencies.append(time.perf_counter() - t)
+    wall = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    transient = 0
+    peak = 0
+    for i in range(iterations):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            w.run(i)
+        except OneWireException:
+            pass
+        _, tx_peak = tracemalloc.get_traced_memory()
+        transient += tx_peak - current
+        peak = max(peak, tx_peak)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    allocations = sum(
+        d.count_diff for d in after.filter_traces(ignored).compare_to(
+            before.filter_traces(ignored), "lineno") if d.count_diff > 0)
+
+    latencies.sort()
+    return {
+        "workload": w.name,
+        "baudrate": baudrate,
+        "iterations": iterations,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "tps": iterations / wall,
+        "bus_utilization": w.bus_time(baudrate) * time_scale * iterations / wall,
+        "errors": errors,
+        "allocations_per_tx": allocations / iterations,
+        "transient_bytes_per_tx": transient / iterations,
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmark(baudrates, iterations, device_count, time_scale,
+                  workload_names=None):
+    register_map = [m for m in get_register_map_list()
+                    if m[0] == "ToF Module"][0]
+    results = []
+    for baudrate in baudrates:
+        devices = [VirtualOneWireDevice(register_map, i + 1,
+                                        baudrate=baudrate)
+                   for i in range(device_count)]
+        # Enough for the longest read, but short for the scan workload
+        timeout = read_transaction_time(253, baudrate, OW_MAX_RETURN_DELAY_TIME,
+                                        HOST_OVERHEAD) * max(time_scale, 0.1)
+        ow = create_virtual_interface(devices, baudrate, timeout,
+                                      time_scale=time_scale)
+        for w in make_workloads(ow, devices, register_map, timeout):
+            if workload_names is None or w.name in workload_names:
+                results.append(run_workload(w, baudrate, iterations,
+                                            time_scale))
+        ow.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=dirname(abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """ Prints the p50 latency and throughput ratios between two runs """
+    old = {(r["workload"], r["baudrate"]): r for r in previous["results"]}
+    for r in current["results"]:
+        o = old.get((r["workload"], r["baudrate"]))
+        if o is None:
+            continue
+        print("{:<12} {:>8}  p50 x{:.2f}  tps x{:.2f}".format(
+            r["workload"], r["baudrate"], r["p50"] / o["p50"],
+            r["tps"] / o["tps"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the OneWire master interface on a virtual bus")
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("-d", "--devices", type=int, default=12)
+    parser.add_argument("-b", "--baudrate", type=int, action="append",
+                        help="baudrate to test (default: all OW_BAUDRATE)")
+    parser.add_argument("-w", "--workload", action="append",
+                        help="workload to run (default: all)")
+    parser.add_argument("-t", "--time-scale", type=float, default=1.0,
+                        help="bus timing scale, 0 measures host overhead only")
+    parser.add_argument("-c", "--compare", help="previous result file")
+    args = parser.parse_args()
+
+    baudrates = args.baudrate or [b.hl_value for b in OW_BAUDRATE]
+    results = run_benchmark(baudrates, args.iterations, args.devices,
+                            args.time_scale, args.workload)
+    output = {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "time_scale": args.time_scale,
+        "results": results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(output, file, indent=1)
+    for r in results:
+        print("{:<12} {:>8}  p50 {:8.1f} us  p99 {:8.1f} us  {:8.0f} tx/s  "
+              "bus {:5.1%}  {:6.1f} alloc/tx  {:6.0f} B/tx  errors {}".format(
+                  r["workload"], r["baudrate"], r["p50"] * 1e6,
+                  r["p99"] * 1e6, r["tps"], r["bus_utilization"],
+                  r["allocations_per_tx"], r["transient_bytes_per_tx"],
+                  r["errors"]))
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            compare(json.load(file), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from one_wire_python import OneWireMasterInterface
+from one_wire_queue import (OneWireRequestQueue, OW_PRIORITY_CONTROL,
+                            OW_PRIORITY_NORMAL, OW_PRIORITY_TELEMETRY)
+from one_wire_shadow import OneWireRegisterShadow
+
+
+class OneWireBus:
+    """ One serial adapter: its interface, its request queue and its devices
+    """
+    def __init__(self, name: str, ow_interface: OneWireMasterInterface):
+        self.name = name
+        self.ow_interface = ow_interface
+        self.devices = OrderedDict()  # device_id -> OneWireRegisterShadow
+        self.queue = OneWireRequestQueue(name)
+
+    def submit(self, fn, *args, priority: int = OW_PRIORITY_NORMAL) -> Future:
+        return self.queue.submit(fn, *args, priority=priority)
+
+    def shutdown(self):
+        self.queue.stop()
+
+
+class OneWireBusManager:
+    """ Owns several OneWire buses and runs each of them on its own worker
+        thread
+
+        Every transaction of a bus is executed by the worker of its
+        OneWireRequestQueue, one at a time, so the buses are driven in
+        parallel while each port is only ever used by a single thread. Writes
+        go first (OW_PRIORITY_CONTROL), then direct calls, then refreshes
+        (OW_PRIORITY_TELEMETRY). Requests are routed by (bus name, device
+        ID) and return a concurrent.futures.Future. Devices are tracked
+        through a OneWireRegisterShadow, from which snapshot() builds a view
+        of every known register of every device.
+    """
+    def __init__(self):
+        self._buses = OrderedDict()  # type: Dict[str, OneWireBus]
+
+    def addBus(self, name: str, ow_interface: OneWireMasterInterface) -> OneWireBus:
+        if name in self._buses:
+            raise ValueError("Bus '" + name + "' already exists")
+        bus = OneWireBus(name, ow_interface)
+        self._buses[name] = bus
+        return bus
+
+    def openBus(self, name: str, port: str, baudrate: int = 400000,
+                timeout: float = 0.1) -> OneWireBus:
+        ow = OneWireMasterInterface(port, baudrate, timeout)
+        ow.open()
+        return self.addBus(name, ow)
+
+    def removeBus(self, name: str) -> None:
+        bus = self._buses.pop(name)
+        bus.shutdown()
+        bus.ow_interface.close()
+
+    def close(self) -> None:
+        for name in list(self._buses.keys()):
+            self.removeBus(name)
+
+    def bus(self, name: str) -> OneWireBus:
+        return self._buses[name]
+
+    def buses(self) -> List[str]:
+        return list(self._buses.keys())
+
+    def addDevice(self, bus: str, device_id: int, register_map,
+                  expect_answer: bool = True) -> OneWireRegisterShadow:
+        b = self._buses[bus]
+        shadow = OneWireRegisterShadow(b.ow_interface, device_id, register_map,
+                                       expect_answer)
+        b.devices[device_id] = shadow
+        return shadow
+
+    def removeDevice(self, bus: str, device_id: int) -> None:
+        del self._buses[bus].devices[device_id]
+
+    def devices(self) -> List[Tuple[str, int]]:
+        return [(b.name, device_id) for b in self._buses.values()
+                for device_id in b.devices]
+
+    def device(self, bus: str, device_id: int) -> OneWireRegisterShadow:
+        return self._buses[bus].devices[device_id]
+
+    def submit(self, bus: str, fn, *args,
+               priority: int = OW_PRIORITY_NORMAL) -> Future:
+        """ Runs fn(ow_interface, *args) on the worker of a bus """
+        b = self._buses[bus]
+        return b.submit(fn, b.ow_interface, *args, priority=priority)
+
+    def call(self, bus: str, method: str, *args,
+             priority: int = OW_PRIORITY_NORMAL) -> Future:
+        """ Calls a method of the interface of a bus on its worker, e.g.
+            call("left", "readBlock", device_id, addr, length)
+        """
+        return self._buses[bus].submit(
+            getattr(self._buses[bus].ow_interface, method), *args,
+            priority=priority)
+
+    def read(self, bus: str, device_id: int, name: str,
+             cached: bool = False) -> Future:
+        b = self._buses[bus]
+        return b.submit(b.devices[device_id].read, name, cached)
+
+    def write(self, bus: str, device_id: int, name: str, value: int) -> Future:
+        """ Writes one register and flushes it, see OneWireRegisterShadow """
+        b = self._buses[bus]
+        return b.submit(self._writeAndFlush, b, device_id, name, value,
+                        priority=OW_PRIORITY_CONTROL)
+
+    def refresh(self, bus: str, device_id: int) -> Future:
+        b = self._buses[bus]
+        return b.submit(b.devices[device_id].refresh,
+                        priority=OW_PRIORITY_TELEMETRY)
+
+    def refreshAll(self) -> Dict[Tuple[str, int], Future]:
+        """ Refreshes every device, the buses being read in parallel """
+        return OrderedDict(((bus, device_id), self.refresh(bus, device_id))
+                           for bus, device_id in self.devices())
+
+    def snapshot(self, metrics: bool = False) -> dict:
+        """ :returns:
+                {bus: {"port": str, "devices": {device_id: {register_name:
+                value}}}} with the last values known for each device, plus
+                "metrics" (OneWireMetrics.snapshot) and "queue"
+                (OneWireRequestQueue.stats) when 'metrics' is True
+        """
+        out = OrderedDict()
+        for b in self._buses.values():
+            devices = OrderedDict()
+            for device_id, shadow in list(b.devices.items()):
+                values = dict(shadow.values)
+                devices[device_id] = OrderedDict(
+                    (e[2], values[e[0]])
+                    for e in shadow.register_map[1] + shadow.register_map[2]
+                    if e[0] in values)
+            out[b.name] = {"port": b.ow_interface.serial.port,
+                           "devices": devices}
+            if metrics:
+                if b.ow_interface.metrics is not None:
+                    out[b.name]["metrics"] = b.ow_interface.metrics.snapshot()
+                out[b.name]["queue"] = b.queue.stats()
+        return out
+
+    @staticmethod
+    def _writeAndFlush(bus: OneWireBus, device_id: int, name: str,
+                       value: int) -> List[Tuple[int, int, Optional[int]]]:
+        shadow = bus.devices[device_id]
+        shadow.write(name, value)
+        result = shadow.flush()
+        if shadow.device_id != device_id:
+            # "Device ID" was written: keep routing to the same device
+            del bus.devices[device_id]
+            bus.devices[shadow.device_id] = shadow
+        return result
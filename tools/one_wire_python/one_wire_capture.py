@@ -0,0 +1,291 @@
+import argparse
+import struct
+import threading
+import time
+from collections import namedtuple
+from os import rename, remove
+from os.path import exists
+from typing import Iterator, List, Optional
+
+from one_wire_parser import OneWireFrameParser
+from one_wire_python import OneWireMasterInterface, ONE_WIRE_BROADCAST_ID
+from reg_map.reg_map import get_register_map_list, decode_register_area
+
+"""
+Capture file format (little endian):
+header: magic b"OWCAP", version (u8), baudrate (u32), start time (f64, time.time())
+records: timestamp (u64, microseconds since the start), direction (u8),
+         length (u16), raw bytes
+
+Records hold the bytes exactly as they went through the serial port (one
+record per write or read call), they are not aligned on frames.
+
+OneWireCaptureRecord: (timestamp, direction, data)
+OneWireCaptureEvent: (timestamp, direction, frame)
+timestamp is in seconds since the start of the capture, frame is a
+OneWireFrame.
+"""
+OneWireCaptureRecord = namedtuple("OneWireCaptureRecord",
+                                  ["timestamp", "direction", "data"])
+OneWireCaptureEvent = namedtuple("OneWireCaptureEvent",
+                                 ["timestamp", "direction", "frame"])
+
+OW_CAPTURE_MAGIC = b"OWCAP"
+OW_CAPTURE_VERSION = 1
+OW_CAPTURE_HEADER = struct.Struct("<5sBId")
+OW_CAPTURE_RECORD = struct.Struct("<QBH")
+OW_CAPTURE_TX = 0
+OW_CAPTURE_RX = 1
+
+
+class OneWireCaptureError(Exception):
+    pass
+
+
+class OneWireCaptureRecorder:
+    """ Appends the raw traffic of a serial port to a capture file
+
+        The file is written through a large buffer, so recording costs one
+        small struct.pack per read/write call. When 'max_size' is given, the
+        file is rotated once it exceeds it: path becomes path.1, path.1
+        becomes path.2... and only 'backups' old files are kept, which bounds
+        the disk usage of multi-hour captures.
+    """
+    def __init__(self, path: str, baudrate: int = 0,
+                 max_size: Optional[int] = None, backups: int = 1,
+                 buffer_size: int = 1 << 16):
+        self.path = path
+        self.baudrate = baudrate
+        self.max_size = max_size
+        self.backups = backups
+        self.buffer_size = buffer_size
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._start = time.monotonic()
+        self._start_time = time.time()
+        self._open()
+
+    def record(self, direction: int, data: bytes):
+        if len(data) == 0:
+            return
+        t = int((time.monotonic() - self._start) * 1e6)
+        with self._lock:
+            if self._file is None:
+                return
+            for i in range(0, len(data), 0xFFFF):
+                chunk = data[i:i + 0xFFFF]
+                self._file.write(OW_CAPTURE_RECORD.pack(t, direction, len(chunk)))
+                self._file.write(chunk)
+                self._size += OW_CAPTURE_RECORD.size + len(chunk)
+                self.records += 1
+            if self.max_size is not None and self._size > self.max_size:
+                self._rotate()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def attach(self, ow_interface) -> "OneWireCaptureSerial":
+        """ Records everything the interface sends and receives from now on
+            (works with any object holding a pyserial port in 'serial')
+        """
+        if not self.baudrate:
+            self.baudrate = ow_interface.serial.baudrate
+        ow_interface.serial = OneWireCaptureSerial(ow_interface.serial, self)
+        return ow_interface.serial
+
+    def _open(self):
+        self._file = open(self.path, 'wb', buffering=self.buffer_size)
+        self._file.write(OW_CAPTURE_HEADER.pack(
+            OW_CAPTURE_MAGIC, OW_CAPTURE_VERSION, self.baudrate,
+            self._start_time))
+        self._size = OW_CAPTURE_HEADER.size
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups > 0:
+            last = "{}.{}".format(self.path, self.backups)
+            if exists(last):
+                remove(last)
+            for i in range(self.backups - 1, 0, -1):
+                old = "{}.{}".format(self.path, i)
+                if exists(old):
+                    rename(old, "{}.{}".format(self.path, i + 1))
+            rename(self.path, self.path + ".1")
+        # Timestamps of the new file stay relative to the same start
+        self._open()
+
+
+class OneWireCaptureSerial:
+    """ Transparent proxy of a pyserial port recording reads and writes """
+    def __init__(self, port, recorder: OneWireCaptureRecorder):
+        object.__setattr__(self, "port_", port)
+        object.__setattr__(self, "recorder", recorder)
+
+    def write(self, data) -> int:
+        n = self.port_.write(data)
+        self.recorder.record(OW_CAPTURE_TX, bytes(data))
+        return n
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.port_.read(size)
+        self.recorder.record(OW_CAPTURE_RX, data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.port_, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.port_, name, value)
+
+
+def read_capture(paths) -> Iterator[OneWireCaptureRecord]:
+    """ Streams the records of one or several capture files (e.g. rotated
+        files, oldest first) without loading them in memory. A record
+        truncated by a crash at the end of a file is ignored.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    record = OW_CAPTURE_RECORD
+    for path in paths:
+        with open(path, 'rb', buffering=1 << 20) as file:
+            read_capture_header(file)
+            while True:
+                head = file.read(record.size)
+                if len(head) < record.size:
+                    break
+                t, direction, length = record.unpack(head)
+                data = file.read(length)
+                if len(data) < length:
+                    break
+                yield OneWireCaptureRecord(t * 1e-6, direction, data)
+
+
+def read_capture_header(file) -> tuple:
+    """ :returns: (baudrate, start_time) """
+    head = file.read(OW_CAPTURE_HEADER.size)
+    if len(head) < OW_CAPTURE_HEADER.size:
+        raise OneWireCaptureError("Truncated capture header")
+    magic, version, baudrate, start_time = OW_CAPTURE_HEADER.unpack(head)
+    if magic != OW_CAPTURE_MAGIC:
+        raise OneWireCaptureError("Not a OneWire capture file")
+    if version != OW_CAPTURE_VERSION:
+        raise OneWireCaptureError("Unsupported capture version: " + str(version))
+    return baudrate, start_time
+
+
+def replay_capture(paths) -> Iterator[OneWireCaptureEvent]:
+    """ Feeds a capture back through one frame parser per direction
+
+        The timestamp of a frame is the one of the record holding its last
+        byte.
+    """
+    parsers = (OneWireFrameParser(), OneWireFrameParser())
+    for r in read_capture(paths):
+        for frame in parsers[r.direction].feed(r.data):
+            yield OneWireCaptureEvent(r.timestamp, r.direction, frame)
+
+
+class OneWireCaptureDecoder:
+    """ Turns replayed frames into readable lines
+
+        Status packets answering a READ are matched with the last request
+        sent to the same device, and split into register values when a
+        register map is given.
+    """
+    def __init__(self, register_map=None):
+        self.registers = []
+        if register_map is not None:
+            self.registers = register_map[1] + register_map[2]
+        self.instruction_names = {v: k for k, v in
+                                  OneWireMasterInterface.Instructions.items()}
+        self._last_request = {}  # device_id -> frame
+
+    def decode(self, event: OneWireCaptureEvent) -> str:
+        f = event.frame
+        if event.direction == OW_CAPTURE_TX:
+            self._last_request[f.id] = f
+            name = self.instruction_names.get(f.instruction, str(f.instruction))
+            text = "{:12.6f} TX id={:<3d} {}".format(event.timestamp, f.id, name)
+            if len(f.data) > 0:
+                text += " addr={} data={}".format(f.data[0], f.data[1:].hex())
+            return text
+        text = "{:12.6f} RX id={:<3d} status={}".format(event.timestamp, f.id,
+                                                       f.instruction)
+        request = self._last_request.pop(f.id, None)
+        if request is not None and \
+                request.instruction == OneWireMasterInterface.Instructions["READ"] \
+                and len(request.data) == 2 and len(f.data) == request.data[1]:
+            values = self._decodeRead(request.data[0], f.data)
+            if len(values) > 0:
+                return text + " " + ", ".join(values)
+        if len(f.data) > 0:
+            text += " data=" + f.data.hex()
+        return text
+
+    def _decodeRead(self, addr: int, data: bytes) -> List[str]:
+        registers = [e for e in self.registers
+                     if e[0] >= addr and e[0] + e[1] <= addr + len(data)]
+        values = decode_register_area(registers, addr, data)
+        return ["{}={}".format(e[2], v) for e, v in zip(registers, values)]
+
+
+def capture_statistics(paths) -> dict:
+    """ Frame counts per (direction, device ID) and unanswered requests """
+    stats = {"tx": {}, "rx": {}, "unanswered": {}}
+    waiting = {}
+    for event in replay_capture(paths):
+        f = event.frame
+        if event.direction == OW_CAPTURE_TX:
+            stats["tx"][f.id] = stats["tx"].get(f.id, 0) + 1
+            if f.id != ONE_WIRE_BROADCAST_ID:
+                if waiting.get(f.id):
+                    stats["unanswered"][f.id] = \
+                        stats["unanswered"].get(f.id, 0) + 1
+                waiting[f.id] = True
+        else:
+            stats["rx"][f.id] = stats["rx"].get(f.id, 0) + 1
+            waiting[f.id] = False
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode OneWire captures")
+    parser.add_argument("files", nargs="+", help="capture files, oldest first")
+    parser.add_argument("-m", "--map", help="register map name")
+    parser.add_argument("-s", "--stats", action="store_true",
+                        help="only print frame statistics")
+    args = parser.parse_args()
+
+    if args.stats:
+        stats = capture_statistics(args.files)
+        for device_id in sorted(set(stats["tx"]) | set(stats["rx"])):
+            print("ID {:3d}: {} request(s), {} answer(s), {} unanswered".format(
+                device_id, stats["tx"].get(device_id, 0),
+                stats["rx"].get(device_id, 0),
+                stats["unanswered"].get(device_id, 0)))
+        return
+
+    register_map = None
+    if args.map is not None:
+        for m in get_register_map_list():
+            if m[0] == args.map:
+                register_map = m
+        if register_map is None:
+            parser.error("Unknown register map: " + args.map)
+    decoder = OneWireCaptureDecoder(register_map)
+    for event in replay_capture(args.files):
+        print(decoder.decode(event))
+
+
+if __name__ == "__main__":
+    main()
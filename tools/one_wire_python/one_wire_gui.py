@@ -1,6 +1,8 @@
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import (QWidget, QGridLayout, QApplication)
 from PyQt5.QtGui import QIcon
-import sys, glob
+import sys
+from functools import partial
 from img.load_img import img
 from one_wire_python import (OneWireMasterInterface, OneWireException,
                              OneWireDataMissing, OneWireComError,
@@ -8,6 +10,14 @@ from one_wire_python import (OneWireMasterInterface, OneWireException,
 from widget_serial_port import WidgetSerialPort
 from widget_device import WidgetDevice
 from widget_register_display import WidgetRegisterDisplay
+from widget_live_plot import WidgetLivePlot
+from one_wire_gui_worker import OneWireGuiWorker
+from one_wire_ports import OneWirePortEnumerator
+from reg_map.reg_map import OW_REGISTER_STRUCTS
+from one_wire_queue import OW_PRIORITY_CONTROL
+from one_wire_scheduler import (OneWirePollingScheduler,
+                                OneWireScheduleInfeasible)
+from one_wire_timeseries import OneWireTimeSeriesStore
 
 
 class OneWireGui:
@@ -24,11 +34,27 @@ class MainWindow(QWidget):
         super().__init__()
         # Members
         self.ow_interface = OneWireMasterInterface()
+        self.worker = OneWireGuiWorker(self)
+        self.port_enumerator = OneWirePortEnumerator()
+        self.port_enumerator.startWatching()
+        self.store = OneWireTimeSeriesStore(capacity=65536, max_age=60.0)
+        self.scheduler = None
+        # The scheduler stops by itself when the port fails
+        self.scheduler_check_timer = QTimer(self)
+        self.scheduler_check_timer.timeout.connect(self._check_scheduler)
 
         # Widgets
         self.w_device = WidgetDevice(self, self.ping, self.soft_reset,
                                      self.factory_reset, self.set_baudrate)
-        self.w_register_display = WidgetRegisterDisplay(self, self.read, self.write)
+        self.w_register_display = WidgetRegisterDisplay(self, self.read, self.write,
+                                                        self.read_block)
+        self.w_live_plot = WidgetLivePlot(self, self.store, self.w_device.get_id,
+                                          self.start_polling,
+                                          self.stop_polling)
+        self.w_live_plot.set_register_map(
+            self.w_register_display.register_entries.register_map)
+        self.w_register_display.register_map_changed.connect(
+            self.w_live_plot.set_register_map)
         self.w_serial_port = WidgetSerialPort(self, self.openConnection,
                                               self.closeConnection,
                                               self.enableGUI,
@@ -39,6 +65,7 @@ class MainWindow(QWidget):
         grid.addWidget(self.w_serial_port, 0, 0)
         grid.addWidget(self.w_device, 1, 0)
         grid.addWidget(self.w_register_display, 0, 1, 3, 1)
+        grid.addWidget(self.w_live_plot, 0, 2, 3, 1)
         grid.setColumnStretch(2, 1)
         grid.setRowStretch(2, 1)
         self.setLayout(grid)
@@ -49,126 +76,217 @@ class MainWindow(QWidget):
 
     def openConnection(self, port):
         try:
-            self.ow_interface.open(port, self.w_device.get_baudrate())
+            with self.ow_interface.lock:
+                self.ow_interface.open(port, self.w_device.get_baudrate())
             return True
         except IOError:
             return False
 
     def closeConnection(self):
-        self.ow_interface.close()
+        self.stop_polling()
+        # Wait for the transaction in progress, if any
+        with self.ow_interface.lock:
+            self.ow_interface.close()
 
     def connectionLost(self):
         self.w_serial_port.connection_lost()
 
     def set_baudrate(self, baudrate):
-        try:
-            self.ow_interface.setBaudrate(baudrate)
-        except IOError:
-            self.connectionLost()
+        # The scheduler does not go through the worker: pause it meanwhile
+        self.stop_polling()
+        self.worker.submit(self.ow_interface.setBaudrate, baudrate,
+                           priority=OW_PRIORITY_CONTROL,
+                           on_result=self._baudrate_set,
+                           on_error=self.handle_bus_error)
+
+    def _baudrate_set(self, _):
+        self.w_live_plot.restart()
 
     def enableGUI(self, e):
         self.w_device.setEnabled(e)
         self.w_register_display.set_enabled(e)
+        self.w_live_plot.set_enabled(e)
+
+    def start_polling(self, subscriptions):
+        """ (Re)starts the background polling feeding the live plot
+
+            :returns:
+                False if the bus cannot sustain the requested rates
+        """
+        self.stop_polling()
+        scheduler = OneWirePollingScheduler(
+            self.ow_interface, callback=self.store.recordSample)
+        for device_id, register_entry, rate in subscriptions:
+            scheduler.subscribe(device_id, register_entry, rate)
+        try:
+            scheduler.start()
+        except OneWireScheduleInfeasible as e:
+            self.w_live_plot.set_status(
+                "The bus cannot sustain these rates\n" + str(e))
+            return False
+        except IOError as e:
+            self.w_live_plot.set_status("Polling failed: " + str(e))
+            self.handle_bus_error(e)
+            return False
+        self.w_live_plot.set_status("")
+        self.scheduler = scheduler
+        self.scheduler_check_timer.start(200)
+        return True
+
+    def stop_polling(self):
+        self.scheduler_check_timer.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    def _check_scheduler(self):
+        if self.scheduler is None or self.scheduler.isRunning():
+            return
+        error = self.scheduler.io_error
+        self.stop_polling()
+        self.w_live_plot.stop()
+        if error is not None:
+            self.w_live_plot.set_status("Polling stopped: " + str(error))
+            self.handle_bus_error(error)
 
     def ping(self):
+        self.w_device.set_ow_status(0)
+        self.worker.submit(self._ping, self.w_device.get_id(),
+                           on_result=self._ping_done,
+                           on_error=self.handle_bus_error)
+
+    def _ping(self, d_id):
+        """ Runs on the worker thread """
+        err = self.ow_interface.ping(d_id)
+        model_nb = None
+        firmware_v = None
         try:
-            self.w_device.set_ow_status(0)
-            d_id = self.w_device.get_id()
-            err = self.ow_interface.ping(d_id)
+            err, srl = self.ow_interface.readU8(d_id, 6)
+        except OneWireTimeout:
+            srl = 0
+        else:
             try:
-                err, srl = self.ow_interface.readU8(d_id, 6)
-            except OneWireTimeout:
-                srl = 0
-            else:
-                try:
-                    err, model = self.ow_interface.readU16(d_id, 0)
-                    self.w_device.set_model_nb(model)
-                    err, firmware = self.ow_interface.readU8(d_id, 2)
-                    self.w_device.set_firmware_version(firmware)
-                except OneWireException:
-                    pass
-            self.w_device.set_return_level(srl)
-            self.w_device.set_device_status(err)
-        except IOError:
-            self.connectionLost()
-        except OneWireException as e:
-            self.handle_ow_error(e)
+                # Model number (U16 at 0), firmware version (U8 at 2)
+                # and return delay time (U8 at 5)
+                err, data = self.ow_interface.readBlock(d_id, 0, 6)
+                model_nb = int.from_bytes(data[0:2], 'little')
+                firmware_v = data[2]
+                self.ow_interface.timeout_model.setReturnDelayTime(d_id, data[5])
+            except OneWireException:
+                pass
+        return err, srl, model_nb, firmware_v
+
+    def _ping_done(self, result):
+        err, srl, model_nb, firmware_v = result
+        if model_nb is not None:
+            self.w_device.set_model_nb(model_nb)
+            self.w_device.set_firmware_version(firmware_v)
+            self.w_register_display.select_model_number(model_nb)
+        self.w_device.set_return_level(srl)
+        self.w_device.set_device_status(err)
 
     def soft_reset(self):
-        try:
-            err = self.ow_interface.softReset(self.w_device.get_id(),
-                                        self.w_device.get_return_level() > 1)
-            if err is not None:
-                self.w_device.set_device_status(err)
-            self.w_device.set_ow_status(0)
-        except IOError:
-            self.connectionLost()
-        except OneWireException as e:
-            self.handle_ow_error(e)
+        self.worker.submit(self.ow_interface.softReset,
+                           self.w_device.get_id(),
+                           self.w_device.get_return_level() > 1,
+                           on_result=self._reset_done,
+                           on_error=self.handle_bus_error)
 
     def factory_reset(self):
-        try:
-            err = self.ow_interface.factoryReset(self.w_device.get_id(),
-                                           self.w_device.get_return_level() > 1)
-            if err is not None:
-                self.w_device.set_device_status(err)
-            self.w_device.set_ow_status(0)
-        except IOError:
-            self.connectionLost()
-        except OneWireException as e:
-            self.handle_ow_error(e)
+        self.worker.submit(self.ow_interface.factoryReset,
+                           self.w_device.get_id(),
+                           self.w_device.get_return_level() > 1,
+                           on_result=self._reset_done,
+                           on_error=self.handle_bus_error)
 
-    def read(self, address, size):
+    def _reset_done(self, err):
+        if err is not None:
+            self.w_device.set_device_status(err)
+        self.w_device.set_ow_status(0)
+
+    def read(self, address, size, on_value):
+        """ Reads a register in the background, on_value(value) is called
+            with None on failure
+
+            :returns:
+                The Future of the request, or None if no request was sent
+        """
         if self.w_device.get_return_level() == 0:
-            raise OneWireDataMissing
-        try:
-            d_id = self.w_device.get_id()
-            if size == 1:
-                err, val = self.ow_interface.readU8(d_id, address)
-            elif size == 2:
-                err, val = self.ow_interface.readU16(d_id, address)
-            elif size == 4:
-                err, val = self.ow_interface.readU32(d_id, address)
-            else:
-                raise RuntimeError("Read function not implemented for size=" +
-                                   str(size))
-        except IOError:
-            self.w_device.set_ow_status(0)
-            self.connectionLost()
-            raise OneWireDataMissing
-        except OneWireException as e:
-            self.handle_ow_error(e)
-            raise OneWireDataMissing
+            on_value(None)
+            return None
+        register_struct = OW_REGISTER_STRUCTS.get(size)
+        if register_struct is None:
+            raise RuntimeError("Read function not implemented for size=" +
+                               str(size))
+        return self.worker.submit(self.ow_interface.readBlock,
+                                  self.w_device.get_id(), address, size,
+                                  on_result=partial(self._read_done, on_value,
+                                                    register_struct),
+                                  on_error=partial(self.handle_bus_error,
+                                                   on_failure=on_value))
+
+    def read_block(self, address, length, on_data):
+        """ Same as read() for a memory block, on_data(data) is called with
+            None on failure
+        """
+        if self.w_device.get_return_level() == 0:
+            on_data(None)
+            return None
+        return self.worker.submit(self.ow_interface.readBlock,
+                                  self.w_device.get_id(), address, length,
+                                  on_result=partial(self._read_done, on_data,
+                                                    None),
+                                  on_error=partial(self.handle_bus_error,
+                                                   on_failure=on_data))
+
+    def _read_done(self, on_value, register_struct, result):
+        err, val = result
+        if register_struct is not None:
+            val, = register_struct.unpack(val)
         self.w_device.set_device_status(err)
         self.w_device.set_ow_status(0)
-        return val
+        on_value(val)
 
-    def write(self, address, size, value):
-        try:
-            d_id = self.w_device.get_id()
-            e_answer = self.w_device.get_return_level() > 1
-            if size == 1:
-                err = self.ow_interface.writeU8(d_id, address, value, e_answer)
-            elif size == 2:
-                err = self.ow_interface.writeU16(d_id, address, value, e_answer)
-            elif size == 4:
-                err = self.ow_interface.writeU32(d_id, address, value, e_answer)
-            else:
-                raise RuntimeError("Write function not implemented for size=" +
-                                   str(size))
-        except IOError:
-            self.w_device.set_ow_status(0)
-            self.connectionLost()
-            return False
-        except OneWireException as e:
-            self.handle_ow_error(e)
-            return False
+    def write(self, address, size, value, on_done):
+        """ Writes a register in the background, on_done(success) is called
+            once the write is over
+        """
+        e_answer = self.w_device.get_return_level() > 1
+        register_struct = OW_REGISTER_STRUCTS.get(size)
+        if register_struct is None:
+            raise RuntimeError("Write function not implemented for size=" +
+                               str(size))
+        return self.worker.submit(self.ow_interface.writeBlock,
+                                  self.w_device.get_id(), address,
+                                  register_struct.pack(value), e_answer,
+                                  priority=OW_PRIORITY_CONTROL,
+                                  on_result=partial(self._write_done, on_done),
+                                  on_error=partial(self.handle_bus_error,
+                                                   on_failure=on_done,
+                                                   failure_value=False))
+
+    def _write_done(self, on_done, err):
         self.w_device.set_ow_status(0)
         if err is not None:
             self.w_device.set_device_status(err)
             if err & 88:
-                return False
-        return True
+                on_done(False)
+                return
+        on_done(True)
+
+    def handle_bus_error(self, e, on_failure=None, failure_value=None):
+        """ Error handler of the requests sent to the worker, then calls
+            on_failure(failure_value)
+        """
+        if isinstance(e, IOError):
+            self.w_device.set_ow_status(0)
+            self.connectionLost()
+        elif isinstance(e, OneWireException):
+            self.handle_ow_error(e)
+        else:
+            raise e
+        if on_failure is not None:
+            on_failure(failure_value)
 
     def handle_ow_error(self, e):
         if isinstance(e, OneWireTimeout):
@@ -184,32 +302,17 @@ class MainWindow(QWidget):
         self.w_device.set_ow_status(s)
 
     def listSerialPorts(self):
-        """ Lists serial port names
+        """ Lists serial port names, without opening them
 
-            :raises EnvironmentError:
-                On unsupported or unknown platforms
             :returns:
-                A list of the serial ports available on the system
+                A list of "port description" strings, sorted by port
         """
-        if sys.platform.startswith('win'):
-            ports = ['COM%s' % (i + 1) for i in range(256)]
-        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            # this excludes your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
-        else:
-            raise EnvironmentError('Unsupported platform')
-
-        result = []
-        for port in ports:
-            p = port.split()[0]
-            if self.openConnection(p):
-                self.closeConnection()
-                result.append(p)
-        return sorted(result)
+        return self.port_enumerator.portNames()
 
     def closeEvent(self, event):
+        self.w_live_plot.stop()
+        self.worker.stop()
+        self.port_enumerator.stopWatching()
         self.closeConnection()
         super().closeEvent(event)
 
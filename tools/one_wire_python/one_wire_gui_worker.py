@@ -0,0 +1,42 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+from concurrent.futures import Future
+from one_wire_queue import OneWireRequestQueue, OW_PRIORITY_NORMAL
+
+
+class OneWireGuiWorker(QObject):
+    """ Runs the bus transactions of the GUI on a background thread
+
+        Work is executed by a OneWireRequestQueue; when it completes, the
+        result (or the exception) is sent back through a Qt signal, so that
+        'on_result' and 'on_error' are always called from the GUI thread.
+        Cancelled requests call neither of them.
+    """
+    _done = pyqtSignal(object, object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = OneWireRequestQueue("GUI")
+        self._done.connect(self._dispatch)
+
+    def submit(self, fn, *args, on_result=None, on_error=None,
+               priority=OW_PRIORITY_NORMAL) -> Future:
+        future = self.queue.submit(fn, *args, priority=priority)
+        future.add_done_callback(
+            lambda f: self._done.emit(f, on_result, on_error))
+        return future
+
+    def stop(self):
+        self.queue.stop()
+
+    @staticmethod
+    def _dispatch(future, on_result, on_error):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is None:
+            if on_result is not None:
+                on_result(future.result())
+        elif on_error is not None:
+            on_error(e)
+        else:
+            raise e
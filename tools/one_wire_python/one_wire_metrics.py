@@ -0,0 +1,153 @@
+import threading
+from bisect import bisect_left
+from typing import Optional
+
+OW_LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1,
+                      0.2, 0.5)  # seconds, upper bounds
+
+OW_ERROR_LABELS = {
+    "OneWireTimeout": "timeout",
+    "OneWireDataMissing": "data_missing",
+    "OneWireChecksumError": "checksum_error",
+    "OneWireComError": "com_error",
+}
+OW_IO_ERROR_LABEL = "io_error"  # any IOError of the serial port
+
+
+class OneWireTransactionStats:
+    __slots__ = ("count", "status_errors", "errors", "latency_sum",
+                 "latency_max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.status_errors = 0  # answers with a non zero status byte
+        self.errors = {}  # error label -> count
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(OW_LATENCY_BUCKETS) + 1)  # last one is +Inf
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.latency_sum += elapsed
+        if elapsed > self.latency_max:
+            self.latency_max = elapsed
+        self.buckets[bisect_left(OW_LATENCY_BUCKETS, elapsed)] += 1
+
+
+class OneWireMetrics:
+    """ Counters and latency histograms per (device ID, instruction)
+
+        Every transaction is counted once, with its duration from the start of
+        the transmission to the reception of the answer (or to the error).
+        Failed transactions are also counted by error kind (timeout,
+        data_missing, checksum_error, com_error, io_error), answers carrying a non zero
+        status byte are counted as status errors. Updates are thread safe.
+    """
+    def __init__(self, instruction_names: Optional[dict] = None):
+        self.instruction_names = instruction_names or {}
+        self._stats = {}  # (device_id, instruction) -> OneWireTransactionStats
+        self._lock = threading.Lock()
+
+    def recordAnswer(self, device_id: int, instruction: int, status: int,
+                     elapsed: float):
+        with self._lock:
+            s = self._entry(device_id, instruction)
+            s.add(elapsed)
+            if status:
+                s.status_errors += 1
+
+    def recordError(self, device_id: int, instruction: int,
+                    error: Exception, elapsed: float):
+        if isinstance(error, IOError):
+            label = OW_IO_ERROR_LABEL
+        else:
+            label = OW_ERROR_LABELS.get(type(error).__name__,
+                                        type(error).__name__)
+        with self._lock:
+            s = self._entry(device_id, instruction)
+            s.add(elapsed)
+            s.errors[label] = s.errors.get(label, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self) -> dict:
+        """ :returns:
+                {device_id: {instruction_name: {"count", "status_errors",
+                "errors", "latency_sum", "latency_max", "latency_buckets"}}}
+                where latency_buckets is a list of (upper bound, cumulative
+                count), the last upper bound being float("inf")
+        """
+        out = {}
+        with self._lock:
+            for (device_id, instruction), s in sorted(self._stats.items()):
+                cumulative = 0
+                buckets = []
+                for le, n in zip(OW_LATENCY_BUCKETS + (float("inf"),),
+                                 s.buckets):
+                    cumulative += n
+                    buckets.append((le, cumulative))
+                out.setdefault(device_id, {})[self._name(instruction)] = {
+                    "count": s.count,
+                    "status_errors": s.status_errors,
+                    "errors": dict(s.errors),
+                    "latency_sum": s.latency_sum,
+                    "latency_max": s.latency_max,
+                    "latency_buckets": buckets,
+                }
+        return out
+
+    def prometheus(self, labels: Optional[dict] = None) -> str:
+        """ Exports the metrics in the Prometheus text exposition format
+
+            :param labels: extra labels added to every sample (e.g. port)
+        """
+        extra = "".join('{}="{}",'.format(k, v)
+                        for k, v in sorted((labels or {}).items()))
+        counts = []
+        status_errors = []
+        errors = []
+        latency = []
+        for device_id, instructions in self.snapshot().items():
+            for name, s in instructions.items():
+                base = '{}device="{}",instruction="{}"'.format(
+                    extra, device_id, name)
+                counts.append("onewire_transactions_total{{{}}} {}".format(
+                    base, s["count"]))
+                status_errors.append(
+                    "onewire_status_errors_total{{{}}} {}".format(
+                        base, s["status_errors"]))
+                for label, n in sorted(s["errors"].items()):
+                    errors.append(
+                        'onewire_errors_total{{{},error="{}"}} {}'.format(
+                            base, label, n))
+                for le, n in s["latency_buckets"]:
+                    latency.append(
+                        'onewire_transaction_seconds_bucket{{{},le="{}"}} {}'
+                        .format(base, "+Inf" if le == float("inf") else le, n))
+                latency.append("onewire_transaction_seconds_sum{{{}}} {}"
+                               .format(base, s["latency_sum"]))
+                latency.append("onewire_transaction_seconds_count{{{}}} {}"
+                               .format(base, s["count"]))
+        lines = [
+            "# HELP onewire_transactions_total OneWire transactions.",
+            "# TYPE onewire_transactions_total counter"] + counts + [
+            "# HELP onewire_status_errors_total Answers with a non zero "
+            "status byte.",
+            "# TYPE onewire_status_errors_total counter"] + status_errors + [
+            "# HELP onewire_errors_total Failed OneWire transactions.",
+            "# TYPE onewire_errors_total counter"] + errors + [
+            "# HELP onewire_transaction_seconds OneWire transaction latency.",
+            "# TYPE onewire_transaction_seconds histogram"] + latency
+        return "\n".join(lines) + "\n"
+
+    def _entry(self, device_id: int, instruction: int) -> OneWireTransactionStats:
+        key = (device_id, instruction)
+        s = self._stats.get(key)
+        if s is None:
+            s = self._stats[key] = OneWireTransactionStats()
+        return s
+
+    def _name(self, instruction: int) -> str:
+        return self.instruction_names.get(instruction, str(instruction))
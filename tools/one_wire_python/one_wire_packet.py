@@ -1,3 +1,15 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from typing import List
+
+ONE_WIRE_PREAMBLE = b"\xFF\xFF"
+ONE_WIRE_MAX_FRAME_SIZE = 4 + 255  # preamble, ID, length, then 'length' bytes
+ONE_WIRE_MIN_FRAME_SIZE = 4  # ID, length, instruction and checksum
+
+
 class OneWirePacket:
     def __init__(self, device_id: int, instruction: int):
         self.id = device_id
@@ -23,10 +35,85 @@ class OneWirePacket:
         out.append(checksum)
         return bytes(out)
 
+    def toFrame(self) -> bytes:
+        """ Returns the whole frame, preamble included """
+        buffer = bytearray(self.length() + 4)
+        self.encodeInto(buffer)
+        return bytes(buffer)
+
+    def encodeInto(self, buffer) -> int:
+        """ Writes the whole frame, preamble included, at the beginning of a
+            preallocated buffer (bytearray or memoryview of at least
+            ONE_WIRE_MAX_FRAME_SIZE bytes)
+
+            :returns:
+                The number of bytes written
+        """
+        length = self.length()
+        end = length + 4
+        buffer[0] = 0xFF
+        buffer[1] = 0xFF
+        buffer[2] = self.id
+        buffer[3] = length
+        buffer[4] = self.instruction
+        i = 5
+        if self.address is not None:
+            buffer[5] = self.address
+            i = 6
+        buffer[i:end - 1] = self.data
+        acc = self.id + length + self.instruction + sum(self.data)
+        if self.address is not None:
+            acc += self.address
+        buffer[end - 1] = 0xFF - (acc & 0xFF)
+        return end
+
     @staticmethod
     def checksum(data: bytes) -> int:
-        acc = 0
-        for b in data:
-            acc += b
-        acc = acc & 0xFF  # keep only the 8 lower weight bits
+        acc = sum(data) & 0xFF  # keep only the 8 lower weight bits
         return 0xFF - acc  # bitwise not on 8 bits
+
+
+class OneWirePreparedRequest:
+    """ Pre-encoded frame of a request sent repeatedly (e.g. polling the same
+        register), sent as is without any per-call encoding
+    """
+    __slots__ = ("id", "instruction", "frame", "expect_answer", "answer_size")
+
+    def __init__(self, packet: OneWirePacket, expect_answer: bool,
+                 answer_size: int = None):
+        self.id = packet.id
+        self.instruction = packet.instruction
+        self.frame = packet.toFrame()
+        self.expect_answer = expect_answer
+        self.answer_size = answer_size
+
+
+def validate_checksums(frames) -> List[bool]:
+    """ Checks the checksum of many frames at once
+
+        Each frame is given without its preamble, from the ID byte to the
+        checksum byte (the output of OneWirePacket.toBytes). A frame is valid
+        when it has at least ID, length, instruction and checksum bytes and
+        the sum of all its bytes, checksum included, ends with 0xFF; shorter
+        (or empty) frames are invalid. Uses NumPy when available.
+
+        :returns:
+            A list of bool, one per frame
+    """
+    if numpy is None or len(frames) == 0:
+        return [len(f) >= ONE_WIRE_MIN_FRAME_SIZE and (sum(f) & 0xFF) == 0xFF
+                for f in frames]
+    lengths = numpy.fromiter(map(len, frames), dtype=numpy.intp,
+                             count=len(frames))
+    valid = lengths >= ONE_WIRE_MIN_FRAME_SIZE
+    if not valid.any():
+        return valid.tolist()
+    if not valid.all():
+        frames = [f for f, v in zip(frames, valid) if v]
+        lengths = lengths[valid]
+    flat = numpy.frombuffer(b"".join(frames), dtype=numpy.uint8)
+    starts = numpy.zeros(len(frames), dtype=numpy.intp)
+    numpy.cumsum(lengths[:-1], out=starts[1:])
+    sums = numpy.add.reduceat(flat, starts, dtype=numpy.uint32)
+    valid[valid] = (sums & 0xFF) == 0xFF
+    return valid.tolist()
@@ -0,0 +1,86 @@
+from collections import namedtuple
+from typing import List
+
+from one_wire_packet import OneWirePacket, ONE_WIRE_PREAMBLE
+
+"""
+OneWireFrame: (id, instruction, data)
+For a status packet, 'instruction' holds the status byte of the device.
+"""
+OneWireFrame = namedtuple("OneWireFrame", ["id", "instruction", "data"])
+
+
+class OneWireFrameParser:
+    """ Incremental frame parser, the host-side equivalent of
+        OneWireSInterface::handleNewByte
+
+        Bytes are accumulated until the 0xFF 0xFF preamble is found, then
+        until the frame announced by the length byte is complete. A bad ID,
+        a bad length or a bad checksum does not discard the whole buffer: the
+        parser restarts hunting for a preamble right after the first byte of
+        the rejected frame, so it resynchronizes on the next valid frame.
+    """
+    def __init__(self, on_checksum_error=None):
+        self._buffer = bytearray()
+        self.on_checksum_error = on_checksum_error
+        self.frames = 0
+        self.bytes_discarded = 0
+        self.checksum_errors = 0
+        self.last_checksum_error_id = None
+
+    def reset(self):
+        self.bytes_discarded += len(self._buffer)
+        self._buffer.clear()
+
+    def pending(self) -> int:
+        """ Number of bytes held waiting for the end of a frame """
+        return len(self._buffer)
+
+    def bytesNeeded(self) -> int:
+        """ Minimum number of bytes needed to complete the current frame """
+        buf = self._buffer
+        if len(buf) < 4:
+            return 4 - len(buf)
+        return max(1, buf[3] + 4 - len(buf))
+
+    def feed(self, data: bytes) -> List[OneWireFrame]:
+        buf = self._buffer
+        buf += data
+        frames = []
+        n = len(buf)
+        pos = 0
+        while True:
+            start = buf.find(ONE_WIRE_PREAMBLE, pos)
+            if start < 0:
+                # Keep a trailing 0xFF, it may be the first byte of a preamble
+                keep = 1 if n > pos and buf[n - 1] == 0xFF else 0
+                self.bytes_discarded += n - pos - keep
+                pos = n - keep
+                break
+            self.bytes_discarded += start - pos
+            pos = start
+            if n - start < 4:
+                break
+            device_id = buf[start + 2]
+            length = buf[start + 3]
+            if device_id == 0xFF or length < 2:
+                self.bytes_discarded += 1
+                pos = start + 1
+                continue
+            end = start + 4 + length
+            if end > n:
+                break
+            if buf[end - 1] == OneWirePacket.checksum(buf[start + 2:end - 1]):
+                frames.append(OneWireFrame(device_id, buf[start + 4],
+                                           bytes(buf[start + 5:end - 1])))
+                pos = end
+            else:
+                self.checksum_errors += 1
+                self.last_checksum_error_id = device_id
+                if self.on_checksum_error is not None:
+                    self.on_checksum_error(device_id)
+                self.bytes_discarded += 1
+                pos = start + 1
+        del buf[:pos]
+        self.frames += len(frames)
+        return frames
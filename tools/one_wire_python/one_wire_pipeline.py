@@ -0,0 +1,163 @@
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional, Tuple
+
+from one_wire_packet import OneWirePacket
+from one_wire_parser import OneWireFrameParser
+from one_wire_timing import frame_time
+from one_wire_python import (OneWireMasterInterface, OneWireException,
+                             OneWireTimeout, OneWireChecksumError,
+                             ONE_WIRE_BROADCAST_ID)
+
+
+class OneWireRequest:
+    def __init__(self, packet: OneWirePacket, expect_answer: bool = True):
+        self.packet = packet
+        self.expect_answer = expect_answer and packet.id != ONE_WIRE_BROADCAST_ID
+        self.request_size = None
+        self.start = None  # time the device got the whole request
+        self.deadline = None
+        self.status = None  # type: Optional[int]
+        self.data = None  # type: Optional[bytes]
+        self.error = None  # type: Optional[OneWireException]
+
+    def result(self) -> Tuple[int, bytes]:
+        if self.error is not None:
+            raise self.error
+        if self.status is None:
+            return 0, bytes()
+        return self.status, self.data
+
+
+class OneWirePipeline:
+    """ Sends requests addressed to different devices back to back, then
+        collects the status packets from the incoming stream and matches them
+        by ID.
+
+        At most one request per device is in flight at a time, so requests
+        sent to the same device are executed in submission order, each with
+        the per-device timeout of the interface as deadline. Broadcast requests
+        act as barriers: everything submitted before them is completed first.
+
+        The devices answer after their own return delay time, which must be
+        staggered (or large enough to cover the transmission of the whole
+        batch) so that their status packets do not overlap on the
+        half-duplex bus.
+    """
+    def __init__(self, ow_interface: OneWireMasterInterface,
+                 max_in_flight: int = 8):
+        assert max_in_flight > 0
+        self.ow_interface = ow_interface
+        self.max_in_flight = max_in_flight
+        self.unexpected_packets = 0
+        self.parser = OneWireFrameParser(self._onChecksumError)
+        self._pending = {}
+        self._start = 0.0  # time the current batch was sent
+
+    def transactions(self, requests: List[OneWireRequest]) -> List[OneWireRequest]:
+        with self.ow_interface.lock:
+            self._transactions(requests)
+        return requests
+
+    def _transactions(self, requests: List[OneWireRequest]) -> None:
+        segment = []
+        for r in requests:
+            if r.packet.id == ONE_WIRE_BROADCAST_ID:
+                self._runSegment(segment)
+                self._runBatch([r])
+                segment = []
+            else:
+                segment.append(r)
+        self._runSegment(segment)
+
+    def _runSegment(self, requests: List[OneWireRequest]) -> None:
+        queues = OrderedDict()
+        for r in requests:
+            queues.setdefault(r.packet.id, deque()).append(r)
+        while len(queues) > 0:
+            batch = []
+            for device_id in list(queues.keys()):
+                if len(batch) == self.max_in_flight:
+                    break
+                q = queues[device_id]
+                batch.append(q.popleft())
+                if len(q) == 0:
+                    del queues[device_id]
+            self._runBatch(batch)
+
+    def _runBatch(self, batch: List[OneWireRequest]) -> None:
+        ow = self.ow_interface
+        serial = ow.serial
+        frames = [r.packet.toFrame() for r in batch]
+        for r, frame in zip(batch, frames):
+            for hook in ow.pre_send_hooks:
+                hook(r.packet.id, r.packet.instruction, frame)
+        self._start = time.monotonic()
+        try:
+            serial.reset_input_buffer()  # late answers of a previous batch
+            serial.write(b"".join(frames))
+        except IOError as e:
+            # The port failed (unplugged adapter...)
+            for r in batch:
+                self._fail(r, e)
+            raise
+        now = time.monotonic()
+        pending = self._pending
+        self.parser.reset()
+        sent = 0
+        for r, frame in zip(batch, frames):
+            # The device only starts answering once its request is through
+            sent += len(frame)
+            timeout = self.ow_interface.transactionTimeout(
+                r.packet.id, len(frame),
+                OneWireMasterInterface._expectedAnswerSize(r.packet))
+            r.request_size = len(frame)
+            r.start = now + frame_time(sent - len(frame), serial.baudrate)
+            r.deadline = now + frame_time(sent, serial.baudrate) + timeout
+            if r.expect_answer:
+                pending[r.packet.id] = r
+            else:
+                ow._notifyAnswer(r.packet.id, r.packet.instruction, 0, bytes(), 0.0)
+
+        while len(pending) > 0:
+            now = time.monotonic()
+            for device_id in [i for i, r in pending.items() if now >= r.deadline]:
+                self._fail(pending.pop(device_id), OneWireTimeout())
+            if len(pending) == 0:
+                break
+            try:
+                data = serial.read(max(1, serial.in_waiting))
+            except IOError as e:
+                for device_id in list(pending):
+                    self._fail(pending.pop(device_id), e)
+                raise
+            for frame in self.parser.feed(data):
+                r = pending.pop(frame.id, None)
+                if r is None:
+                    self.unexpected_packets += 1
+                    continue
+                packet = r.packet
+                if packet.instruction == ow.Instructions["READ"]:
+                    try:
+                        ow._checkReadAnswer(frame.data, packet.data[0])
+                    except OneWireException as e:
+                        self._fail(r, e)
+                        continue
+                ow.timeout_model.observe(
+                    frame.id, r.request_size,
+                    OneWireMasterInterface._expectedAnswerSize(packet),
+                    serial.baudrate, time.monotonic() - r.start)
+                r.status = frame.instruction
+                r.data = frame.data
+                ow._notifyAnswer(frame.id, packet.instruction, r.status,
+                                 r.data, time.monotonic() - self._start)
+
+    def _onChecksumError(self, device_id: int) -> None:
+        r = self._pending.pop(device_id, None)
+        if r is not None:
+            self._fail(r, OneWireChecksumError())
+
+    def _fail(self, r: OneWireRequest, error: Exception) -> None:
+        r.error = error
+        self.ow_interface._notifyError(r.packet.id, r.packet.instruction, error,
+                                       time.monotonic() - self._start)
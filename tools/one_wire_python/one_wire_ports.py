@@ -0,0 +1,129 @@
+import sys
+import threading
+import time
+from collections import namedtuple
+from os import listdir
+from os.path import exists, join
+from typing import Callable, List, Optional
+
+from serial.tools import list_ports
+
+from one_wire_scanner import OneWireScanner
+
+"""
+OneWirePortInfo: (device, description, hwid, vid, pid, serial_number,
+                  has_devices)
+has_devices is None until the port has been probed, then True when at least
+one OneWire device answered.
+"""
+OneWirePortInfo = namedtuple("OneWirePortInfo", [
+    "device", "description", "hwid", "vid", "pid", "serial_number",
+    "has_devices"])
+
+OW_SYSFS_TTY = "/sys/class/tty"
+
+
+class OneWirePortEnumerator:
+    """ Lists the serial ports of the system without opening them
+
+        The list comes from serial.tools.list_ports (sysfs on Linux, which
+        already skips the virtual consoles) and is cached. The cache is
+        refreshed when it gets older than 'max_age', or as soon as a port is
+        plugged or unplugged if the hotplug watcher is started: it compares
+        the cheap list of /sys/class/tty entries backed by a device (or the
+        port list on other platforms) every 'poll_period' seconds.
+
+        Legacy on-board UARTs reported without any hardware information
+        (e.g. the 32 /dev/ttyS* of a PC) are hidden unless
+        'include_legacy' is True.
+    """
+    def __init__(self, max_age: float = 5.0, include_legacy: bool = False,
+                 poll_period: float = 1.0):
+        self.max_age = max_age
+        self.include_legacy = include_legacy
+        self.poll_period = poll_period
+        self.callbacks = []  # type: List[Callable[[List[OneWirePortInfo]], None]]
+        self._ports = []  # type: List[OneWirePortInfo]
+        self._probed = {}  # device -> has_devices
+        self._timestamp = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def ports(self, refresh: bool = False) -> List[OneWirePortInfo]:
+        with self._lock:
+            if refresh or self._timestamp is None or \
+                    time.monotonic() - self._timestamp > self.max_age:
+                self._refresh()
+            return list(self._ports)
+
+    def portNames(self, refresh: bool = False) -> List[str]:
+        """ 'device description' strings, as shown by the GUI """
+        names = []
+        for p in self.ports(refresh):
+            name = p.device
+            if p.description and p.description != "n/a":
+                name += " " + p.description
+            if p.has_devices:
+                name += " (devices found)"
+            names.append(name)
+        return names
+
+    def probe(self, baudrate: int = 400000, device_ids=range(1, 11),
+              ports: Optional[List[str]] = None) -> List[OneWirePortInfo]:
+        """ Pings a few IDs on every port in parallel and records which ones
+            have live devices. The ports are opened, so busy ports are
+            reported as empty.
+        """
+        if ports is None:
+            ports = [p.device for p in self.ports()]
+        scanner = OneWireScanner(ports, [baudrate], device_ids)
+        found = set(r.port for r in scanner.scan())
+        with self._lock:
+            for port in ports:
+                self._probed[port] = port in found
+            self._ports = [p._replace(has_devices=self._probed.get(p.device))
+                           for p in self._ports]
+            return list(self._ports)
+
+    def startWatching(self):
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._signature = self._hotplugSignature()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stopWatching(self):
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def _refresh(self):
+        ports = []
+        for p in list_ports.comports():
+            if not self.include_legacy and p.hwid == "n/a" and p.vid is None:
+                continue
+            ports.append(OneWirePortInfo(p.device, p.description, p.hwid,
+                                         p.vid, p.pid, p.serial_number,
+                                         self._probed.get(p.device)))
+        self._ports = sorted(ports, key=lambda x: x.device)
+        self._timestamp = time.monotonic()
+
+    def _hotplugSignature(self) -> tuple:
+        if sys.platform.startswith('linux') and exists(OW_SYSFS_TTY):
+            return tuple(sorted(n for n in listdir(OW_SYSFS_TTY)
+                                if exists(join(OW_SYSFS_TTY, n, "device"))))
+        return tuple(sorted(p.device for p in list_ports.comports()))
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_period):
+            signature = self._hotplugSignature()
+            if signature == self._signature:
+                continue
+            self._signature = signature
+            ports = self.ports(refresh=True)
+            for callback in self.callbacks:
+                callback(ports)
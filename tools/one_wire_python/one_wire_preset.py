@@ -0,0 +1,221 @@
+import json
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from reg_map.reg_map import compile_register_map, default_catalog
+
+"""
+Binary EEPROM image (.owb), little endian:
+magic b"OWPS", schema version (u8), model number (u16), firmware version
+(u8), start address (u8), length (u16), map name length (u8), map name
+(utf-8), raw EEPROM bytes, CRC32 of everything before it (u32)
+"""
+OW_PRESET_MAGIC = b"OWPS"
+OW_PRESET_VERSION = 1
+OW_PRESET_HEADER = struct.Struct("<4sBHBBHB")
+OW_PRESET_CRC = struct.Struct("<I")
+OW_WRITE_OVERHEAD = 7  # preamble, ID, length, instruction, address, checksum
+
+
+class OneWirePresetError(Exception):
+    pass
+
+
+class OneWirePresetImage:
+    """ Raw EEPROM bytes of a device, with the identity of its map """
+    def __init__(self, map_name: str, model_number: int,
+                 firmware_version: int, start: int, data: bytes):
+        self.map_name = map_name
+        self.model_number = model_number
+        self.firmware_version = firmware_version
+        self.start = start
+        self.data = bytes(data)
+
+    @classmethod
+    def fromValues(cls, register_map, values: Dict[str, int]):
+        """ Builds the image of the EEPROM area from {name: value}, every
+            register of the area being required
+        """
+        register_map = compile_register_map(register_map)
+        eeprom = register_map.eeprom
+        missing = [r.name for r in eeprom if r.name not in values]
+        if len(missing) > 0:
+            raise OneWirePresetError("Missing EEPROM registers: " +
+                                     ", ".join(missing))
+        data = eeprom.encode(values)
+        return cls(register_map.name, values.get("Model number", 0),
+                   values.get("Firmware version", 0), eeprom.start, data)
+
+    @classmethod
+    def fromTriples(cls, register_map, triples,
+                    defaults: Optional[Dict[str, int]] = None):
+        """ Converts a .ow preset ([[address, size, value], ...]); registers
+            missing from the preset are taken from 'defaults' ({name: value})
+        """
+        register_map = compile_register_map(register_map)
+        values = dict(defaults or {})
+        for address, size, value in triples:
+            r = register_map.by_address.get(address)
+            if r is None or r.size != size:
+                raise OneWirePresetError("Preset entry at " + str(address) +
+                                         " does not match the register map")
+            values[r.name] = value
+        return cls.fromValues(register_map, values)
+
+    def registerMap(self):
+        """ Register map of the image, looked up in the default catalog by
+            name, then by model number
+        """
+        catalog = default_catalog()
+        register_map = catalog.get(self.map_name)
+        if register_map is None:
+            register_map = catalog.byModelNumber(self.model_number)
+        if register_map is None:
+            raise OneWirePresetError("No register map for '" + self.map_name +
+                                     "'")
+        return compile_register_map(register_map)
+
+    def values(self, register_map=None) -> OrderedDict:
+        """ Decodes the image with the layout of its register map """
+        if register_map is None:
+            register_map = self.registerMap()
+        return compile_register_map(register_map).decodeBlock(self.start,
+                                                              self.data)
+
+    def triples(self, register_map=None) -> List[tuple]:
+        """ Values as .ow preset entries: [(address, size, value), ...] """
+        if register_map is None:
+            register_map = self.registerMap()
+        register_map = compile_register_map(register_map)
+        result = []
+        for name, value in self.values(register_map).items():
+            r = register_map.by_name[name]
+            result.append((r.address, r.size, value))
+        return result
+
+    def toBytes(self) -> bytes:
+        name = self.map_name.encode('utf-8')
+        if len(name) > 255:
+            raise OneWirePresetError("Map name too long")
+        body = OW_PRESET_HEADER.pack(
+            OW_PRESET_MAGIC, OW_PRESET_VERSION, self.model_number,
+            self.firmware_version, self.start, len(self.data),
+            len(name)) + name + self.data
+        return body + OW_PRESET_CRC.pack(zlib.crc32(body))
+
+    @classmethod
+    def fromBytes(cls, raw: bytes):
+        if len(raw) < OW_PRESET_HEADER.size + OW_PRESET_CRC.size:
+            raise OneWirePresetError("Truncated image")
+        magic, version, model_number, firmware_version, start, length, \
+            name_length = OW_PRESET_HEADER.unpack_from(raw)
+        if magic != OW_PRESET_MAGIC:
+            raise OneWirePresetError("Not a OneWire EEPROM image")
+        if version != OW_PRESET_VERSION:
+            raise OneWirePresetError("Unsupported image version: " +
+                                     str(version))
+        end = OW_PRESET_HEADER.size + name_length + length
+        if len(raw) != end + OW_PRESET_CRC.size:
+            raise OneWirePresetError("Truncated image")
+        crc, = OW_PRESET_CRC.unpack_from(raw, end)
+        if crc != zlib.crc32(raw[:end]):
+            raise OneWirePresetError("Image checksum mismatch")
+        name = raw[OW_PRESET_HEADER.size:OW_PRESET_HEADER.size + name_length]
+        return cls(name.decode('utf-8'), model_number, firmware_version, start,
+                   raw[end - length:end])
+
+    def save(self, path: str):
+        with open(path, 'wb') as file:
+            file.write(self.toBytes())
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, 'rb') as file:
+            return cls.fromBytes(file.read())
+
+
+def parse_json_preset(raw: bytes) -> List[tuple]:
+    """ Entries of a .ow preset, which may cover only part of the EEPROM:
+        [(address, size, value), ...]
+    """
+    try:
+        entries = json.loads(raw.decode('utf-8'))
+        return [(int(a), int(s), int(v)) for a, s, v in entries]
+    except (UnicodeDecodeError, ValueError, TypeError):
+        raise OneWirePresetError("Unknown preset format")
+
+
+def read_preset_triples(path: str, register_map) -> List[tuple]:
+    """ Entries of a binary image (decoded with 'register_map') or of a .ow
+        JSON preset: [(address, size, value), ...]
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+    if raw.startswith(OW_PRESET_MAGIC):
+        return OneWirePresetImage.fromBytes(raw).triples(register_map)
+    return parse_json_preset(raw)
+
+
+def load_preset(path: str, register_map,
+                defaults: Optional[Dict[str, int]] = None) -> OneWirePresetImage:
+    """ Loads a binary image or a .ow JSON preset, see fromTriples() for
+        'defaults'
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+    if raw.startswith(OW_PRESET_MAGIC):
+        return OneWirePresetImage.fromBytes(raw)
+    return OneWirePresetImage.fromTriples(register_map, parse_json_preset(raw),
+                                          defaults)
+
+
+def writable_mask(register_map, start: int, length: int) -> bytearray:
+    """ 1 for each byte of [start, start + length) belonging to a writable
+        register
+    """
+    mask = bytearray(length)
+    for r in compile_register_map(register_map).registers:
+        if r.writable:
+            for a in range(max(r.address, start),
+                           min(r.address + r.size, start + length)):
+                mask[a - start] = 1
+    return mask
+
+
+def diff_ranges(register_map, start: int, current: bytes, target: bytes,
+                merge_gap: int = OW_WRITE_OVERHEAD,
+                max_length: int = 252) -> List[Tuple[int, bytes]]:
+    """ Minimal contiguous WRITE ranges turning 'current' into 'target'
+
+        Only writable registers are written, and always as a whole. Two
+        ranges separated by at most 'merge_gap' writable bytes are merged,
+        since resending a few identical bytes is cheaper than the overhead
+        of another WRITE packet.
+
+        :returns: [(address, bytes to write), ...]
+    """
+    if len(current) != len(target):
+        raise ValueError("Images of different sizes")
+    register_map = compile_register_map(register_map)
+    end = start + len(target)
+    changed = []  # registers to write, in address order
+    for r in register_map.registers:
+        if r.writable and r.address >= start and r.address + r.size <= end:
+            o = r.address - start
+            if current[o:o + r.size] != target[o:o + r.size]:
+                changed.append(r)
+    changed.sort(key=lambda x: x.address)
+    mask = writable_mask(register_map, start, len(target))
+    ranges = []  # [first address, end address]
+    for r in changed:
+        if len(ranges) > 0:
+            gap_start, gap_end = ranges[-1][1], r.address
+            if gap_end - gap_start <= merge_gap and \
+                    r.address + r.size - ranges[-1][0] <= max_length and \
+                    all(mask[gap_start - start:gap_end - start]):
+                ranges[-1][1] = r.address + r.size
+                continue
+        ranges.append([r.address, r.address + r.size])
+    return [(a, bytes(target[a - start:e - start])) for a, e in ranges]
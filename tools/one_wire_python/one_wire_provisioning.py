@@ -0,0 +1,430 @@
+import argparse
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, List, Optional
+
+from one_wire_def import OW_BAUDRATE
+from one_wire_preset import diff_ranges, read_preset_triples
+from one_wire_python import (OneWireMasterInterface, OneWireException,
+                             ONE_WIRE_BROADCAST_ID, ONE_WIRE_MAX_LENGTH)
+from one_wire_queue import OW_PRIORITY_CONTROL
+from reg_map.reg_map import compile_register_map, default_catalog
+
+OW_CHECKED_REGISTERS = ("Model number",)
+
+
+class OneWireProvisioningReport:
+    """ Outcome of the provisioning of one device
+
+        status: "ok", "unchanged", "unreachable", "model mismatch",
+        "verify failed", "id conflict" or "error"
+        diff: [(register name, value before, value wanted), ...]
+        mismatches: same as diff, for the registers still wrong after the
+        read-back (value read, value wanted)
+    """
+    def __init__(self, device_id: int):
+        self.device_id = device_id
+        self.new_id = device_id
+        self.status = None
+        self.diff = []
+        self.mismatches = []
+        self.packets = 0
+        self.error = None  # type: Optional[str]
+
+    def __repr__(self):
+        return "OneWireProvisioningReport({}, {})".format(self.device_id,
+                                                          self.status)
+
+
+class OneWireProvisioner:
+    """ Applies an EEPROM preset to several devices of one bus
+
+        Sequence:
+        1. one block read of the EEPROM of every device, which gives the
+           diff against the preset (devices whose "Model number" does not
+           match the preset are left untouched);
+        2. the changed registers are grouped into contiguous runs by
+           diff_ranges(); a run needed by several devices with the same bytes is sent with
+           SYNC_WRITE, others with WRITE;
+        3. one block read-back per device verifies the whole EEPROM;
+        4. new IDs ('new_ids') are written one device at a time, after
+           checking that no other device answers on the new ID; chained
+           renames are ordered (1 -> 2 is done after 2 -> 3) and a cycle
+           goes through a free temporary ID;
+        5. the baudrate is written last, then the host switches to it and
+           pings every device.
+
+        The "Device ID" of the preset is never applied to the whole fleet,
+        use 'new_ids' instead. Writes are only answered when the status
+        return level of the device allows it both before and after the
+        provisioning; the read-back is what decides success anyway.
+    """
+    def __init__(self, ow_interface: OneWireMasterInterface, register_map,
+                 preset: Dict[int, tuple], apply_baudrate: bool = True):
+        self.ow_interface = ow_interface
+        self.register_map = compile_register_map(register_map)
+        self.eeprom = self.register_map.eeprom
+        self.apply_baudrate = apply_baudrate
+        self.target = {}  # register name -> value
+        self.expected = {}  # read-only register name -> value
+        self._data = {}  # device ID -> raw EEPROM read at the start of run()
+        for address, (size, value) in preset.items():
+            r = self.register_map.by_address.get(address)
+            if r is None or r.size != size:
+                raise ValueError("Preset entry at " + str(address) +
+                                 " does not match the register map")
+            if r.name in OW_CHECKED_REGISTERS:
+                self.expected[r.name] = value
+            elif r.writable and r.name != "Device ID" and \
+                    (apply_baudrate or r.name != "Baudrate"):
+                r.validate(value)
+                self.target[r.name] = value
+
+    def run(self, device_ids: List[int],
+            new_ids: Optional[Dict[int, int]] = None,
+            dry_run: bool = False) -> List[OneWireProvisioningReport]:
+        new_ids = dict(new_ids or {})
+        reports = OrderedDict((i, OneWireProvisioningReport(i))
+                              for i in device_ids)
+        images = OrderedDict()
+        self._data.clear()
+        for device_id, report in reports.items():
+            image = self._readEeprom(report)
+            if image is not None:
+                images[device_id] = image
+        wanted = {}
+        for device_id, image in images.items():
+            wanted[device_id] = self._wanted(image)
+            reports[device_id].diff = [
+                (name, image[name], value)
+                for name, value in wanted[device_id].items()
+                if image[name] != value]
+        if dry_run:
+            for device_id in images:
+                r = reports[device_id]
+                r.status = "ok" if len(r.diff) > 0 else "unchanged"
+            return list(reports.values())
+
+        baudrates = {}
+        for device_id, image in images.items():
+            w = dict(wanted[device_id])
+            baudrates[device_id] = w.pop("Baudrate", None)
+            changes = {n: v for n, v in w.items() if image[n] != v}
+            wanted[device_id] = changes
+        self._writeRuns(reports, images, wanted)
+
+        for device_id, image in images.items():
+            self._verify(reports[device_id], image, wanted[device_id])
+        self._changeIds(reports, new_ids)
+        if self.apply_baudrate:
+            self._changeBaudrate(reports, images, baudrates)
+        for r in reports.values():
+            if r.status is None:
+                r.status = "ok" if len(r.diff) > 0 or r.new_id != r.device_id \
+                    else "unchanged"
+        return list(reports.values())
+
+    def _readEeprom(self, report: OneWireProvisioningReport):
+        try:
+            _, data = self.ow_interface.readBlock(
+                report.device_id, self.eeprom.start, self.eeprom.length)
+        except OneWireException as e:
+            report.status = "unreachable"
+            report.error = type(e).__name__
+            return None
+        self._data[report.device_id] = bytes(data)
+        image = self.eeprom.decode(data)
+        for name, value in self.expected.items():
+            if image[name] != value:
+                report.status = "model mismatch"
+                report.error = "{} is {}, preset expects {}".format(
+                    name, image[name], value)
+                return None
+        return image
+
+    def _wanted(self, image) -> OrderedDict:
+        return OrderedDict((r.name, self.target[r.name]) for r in self.eeprom
+                           if r.name in self.target)
+
+    def _expectAnswer(self, image, changes) -> bool:
+        srl = "Status return level"
+        if srl not in image:
+            return True
+        return image[srl] == 2 and changes.get(srl, 2) == 2
+
+    def _runs(self, device_id: int, changes: dict) -> List[tuple]:
+        """ Contiguous write ranges of a device: [(address, bytes), ...] """
+        current = self._data[device_id]
+        target = bytearray(current)
+        for name, value in changes.items():
+            r = self.register_map.by_name[name]
+            offset = r.address - self.eeprom.start
+            target[offset:offset + r.size] = r.encode(value)
+        return diff_ranges(self.register_map, self.eeprom.start, current,
+                           target)
+
+    def _writeRuns(self, reports, images, changes):
+        groups = OrderedDict()  # (address, bytes) -> [device_id, ...]
+        for device_id, c in changes.items():
+            for run in self._runs(device_id, c):
+                groups.setdefault(run, []).append(device_id)
+        ow = self.ow_interface
+        for (address, data), ids in groups.items():
+            try:
+                if len(ids) == 1:
+                    device_id = ids[0]
+                    expect_answer = self._expectAnswer(images[device_id],
+                                                       changes[device_id])
+                    err = ow.writeBlock(device_id, address, data, expect_answer)
+                    reports[device_id].packets += 1
+                    if err:
+                        reports[device_id].error = "status " + str(err)
+                    if not expect_answer:
+                        self._drain()
+                    continue
+                per_packet = max(1, (ONE_WIRE_MAX_LENGTH - 4) // (len(data) + 1))
+                for i in range(0, len(ids), per_packet):
+                    chunk = ids[i:i + per_packet]
+                    ow.syncWrite(chunk, address, [data] * len(chunk))
+                    for device_id in chunk:
+                        reports[device_id].packets += 1
+            except OneWireException as e:
+                for device_id in ids:
+                    reports[device_id].error = type(e).__name__
+
+    def _verify(self, report, image, changes):
+        expected = dict(image)
+        expected.update(changes)
+        try:
+            _, data = self.ow_interface.readBlock(
+                report.device_id, self.eeprom.start, self.eeprom.length)
+        except OneWireException as e:
+            report.status = "verify failed"
+            report.error = type(e).__name__
+            return
+        actual = self.eeprom.decode(data)
+        report.mismatches = [(n, actual[n], v) for n, v in expected.items()
+                             if n in actual and actual[n] != v]
+        if len(report.mismatches) > 0:
+            report.status = "verify failed"
+        rdt = "Return delay time"
+        if rdt in actual:
+            self.ow_interface.timeout_model.setReturnDelayTime(
+                report.device_id, actual[rdt])
+
+    def _drain(self):
+        """ Waits for a possible answer to a write sent without waiting for
+            it, and drops it
+        """
+        ow = self.ow_interface
+        ow.serial.flush()
+        time.sleep(ow.timeout)
+        ow.serial.reset_input_buffer()
+
+    def _changeIds(self, reports, new_ids):
+        if "Device ID" not in self.register_map.by_name:
+            return
+        targets = list(new_ids.values())
+        pending = OrderedDict()  # current ID -> (report, new ID)
+        for old_id, new_id in new_ids.items():
+            r = reports.get(old_id)
+            if r is None or r.status is not None or old_id == new_id:
+                continue
+            if targets.count(new_id) > 1:
+                self._idConflict(r, new_id)
+            else:
+                pending[old_id] = (r, new_id)
+        # A new ID must be free on the bus, or freed by another rename
+        for old_id, (r, new_id) in list(pending.items()):
+            if new_id in pending:
+                continue
+            conflict = new_id in reports
+            if not conflict:
+                try:
+                    self.ow_interface.ping(new_id)
+                    conflict = True
+                except OneWireException:
+                    pass
+            if conflict:
+                del pending[old_id]
+                self._idConflict(r, new_id)
+                self._cancelRenames(pending, old_id)
+
+        # Renames are done once their new ID is free (1 -> 2 after 2 -> 3);
+        # in a cycle (1 -> 2, 2 -> 1) one device goes through a free ID
+        while len(pending) > 0:
+            ready = [i for i, (_, new_id) in pending.items()
+                     if new_id not in pending]
+            if len(ready) > 0:
+                old_id = ready[0]
+                r, new_id = pending.pop(old_id)
+                if self._writeId(r, old_id, new_id):
+                    r.new_id = new_id
+                    r.diff.append(("Device ID", r.device_id, new_id))
+                else:
+                    self._cancelRenames(pending, old_id)
+                continue
+            old_id, (r, new_id) = pending.popitem(last=False)
+            temp_id = self._freeId(reports, new_ids)
+            if temp_id is None:
+                r.status = "error"
+                r.error = "ID change: no free ID to break the cycle"
+                self._cancelRenames(pending, old_id)
+            elif self._writeId(r, old_id, temp_id):
+                pending[temp_id] = (r, new_id)
+            else:
+                self._cancelRenames(pending, old_id)
+
+    def _writeId(self, report, old_id: int, new_id: int) -> bool:
+        ow = self.ow_interface
+        id_register = self.register_map.by_name["Device ID"]
+        try:
+            # The answer may come from either ID: do not wait for it
+            ow.writeBlock(old_id, id_register.address,
+                          id_register.encode(new_id), False)
+            report.packets += 1
+            self._drain()
+            ow.ping(new_id)
+        except OneWireException as e:
+            report.status = "error"
+            report.error = "ID change: " + type(e).__name__
+            return False
+        return True
+
+    def _freeId(self, reports, new_ids) -> Optional[int]:
+        """ An ID used by no device of the bus, None if there is none """
+        used = set(reports) | set(new_ids) | set(new_ids.values())
+        for device_id in range(ONE_WIRE_BROADCAST_ID - 1, -1, -1):
+            if device_id in used:
+                continue
+            try:
+                self.ow_interface.ping(device_id)
+            except OneWireException:
+                return device_id
+        return None
+
+    def _cancelRenames(self, pending, device_id: int):
+        """ Device 'device_id' keeps its ID: the rename waiting for it, and
+            those waiting for that one, cannot be done
+        """
+        blocked = [i for i, (_, new_id) in pending.items()
+                   if new_id == device_id]
+        for old_id in blocked:
+            r, new_id = pending.pop(old_id)
+            self._idConflict(r, new_id)
+            self._cancelRenames(pending, old_id)
+
+    @staticmethod
+    def _idConflict(report, new_id: int):
+        report.status = "id conflict"
+        report.error = "ID " + str(new_id) + " is already used"
+
+    def _changeBaudrate(self, reports, images, baudrates):
+        ow = self.ow_interface
+        changed = [r for r in reports.values() if r.status is None and
+                   baudrates.get(r.device_id) is not None and
+                   images[r.device_id]["Baudrate"] != baudrates[r.device_id]]
+        if len(changed) == 0:
+            return
+        register = self.register_map.by_name["Baudrate"]
+        code = baudrates[changed[0].device_id]
+        try:
+            for r in changed:
+                ow.writeBlock(r.new_id, register.address, register.encode(code),
+                              False)
+                r.packets += 1
+            self._drain()
+        except OneWireException as e:
+            for r in changed:
+                r.status = "error"
+                r.error = "Baudrate change: " + type(e).__name__
+            return
+        baudrate = [b.hl_value for b in OW_BAUDRATE if b.ll_value == code]
+        if len(baudrate) == 0:
+            return  # not a baudrate the host knows, nothing to check
+        ow.setBaudrate(baudrate[0])
+        self._drain()  # let the devices switch
+        for r in changed:
+            try:
+                ow.ping(r.new_id)
+            except OneWireException as e:
+                r.status = "error"
+                r.error = "No answer at the new baudrate: " + type(e).__name__
+
+
+def provision_buses(bus_manager, register_map, preset,
+                    targets: Dict[str, List[int]], **options) -> Dict[str, list]:
+    """ Provisions several buses of a OneWireBusManager in parallel
+
+        :param targets: {bus name: [device_id, ...]}
+        :param options: passed to OneWireProvisioner.run
+        :returns: {bus name: [OneWireProvisioningReport, ...]}
+    """
+    futures = OrderedDict()
+    for bus, device_ids in targets.items():
+        b = bus_manager.bus(bus)
+        provisioner = OneWireProvisioner(b.ow_interface, register_map, preset)
+        futures[bus] = b.submit(partial(provisioner.run, device_ids, **options),
+                                priority=OW_PRIORITY_CONTROL)
+    return OrderedDict((bus, f.result()) for bus, f in futures.items())
+
+
+def format_provisioning_report(reports: List[OneWireProvisioningReport]) -> str:
+    lines = []
+    for r in reports:
+        title = "ID {:3d}".format(r.device_id)
+        if r.new_id != r.device_id:
+            title += " -> {}".format(r.new_id)
+        title += ": {} ({} packet(s))".format(r.status, r.packets)
+        if r.error is not None:
+            title += " " + r.error
+        lines.append(title)
+        for name, before, after in r.diff:
+            lines.append("    {:<32} {:>10} -> {}".format(name, before, after))
+        for name, actual, expected in r.mismatches:
+            lines.append("    MISMATCH {:<23} {:>10} != {}".format(
+                name, actual, expected))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply an EEPROM preset to several OneWire devices")
+    parser.add_argument("preset", help=".ow preset or binary EEPROM image")
+    parser.add_argument("-p", "--port", required=True)
+    parser.add_argument("-b", "--baudrate", type=int, default=400000)
+    parser.add_argument("-m", "--map", required=True, help="register map name")
+    parser.add_argument("-i", "--id", type=int, action="append", required=True,
+                        help="device ID to provision")
+    parser.add_argument("--new-id", action="append", default=[],
+                        help="ID change, as OLD:NEW")
+    parser.add_argument("--keep-baudrate", action="store_true",
+                        help="do not apply the baudrate of the preset")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="only print the diff")
+    args = parser.parse_args()
+
+    register_map = default_catalog().get(args.map)
+    if register_map is None:
+        parser.error("Unknown register map: " + args.map)
+    new_ids = {}
+    for change in args.new_id:
+        old, new = change.split(":")
+        new_ids[int(old)] = int(new)
+    preset = OrderedDict(
+        (a, (s, v)) for a, s, v in read_preset_triples(args.preset,
+                                                       register_map))
+    ow = OneWireMasterInterface(args.port, args.baudrate)
+    ow.open()
+    try:
+        provisioner = OneWireProvisioner(ow, register_map, preset,
+                                         not args.keep_baudrate)
+        reports = provisioner.run(args.id, new_ids, args.dry_run)
+    finally:
+        ow.close()
+    print(format_provisioning_report(reports))
+
+
+if __name__ == "__main__":
+    main()
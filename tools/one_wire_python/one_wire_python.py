@@ -1,10 +1,20 @@
+import math
 import serial
 import struct
+import threading
+import time
 from typing import Tuple, List, Optional
 
-from one_wire_packet import OneWirePacket
+from one_wire_metrics import OneWireMetrics
+from one_wire_packet import (OneWirePacket, OneWirePreparedRequest,
+                             ONE_WIRE_MAX_FRAME_SIZE)
+from one_wire_parser import OneWireFrameParser
+from one_wire_timing import OneWireTimeoutModel, OW_STATUS_OVERHEAD
 
-ONE_WIRE_BROADCAST_ID = 0xFD
+ONE_WIRE_BROADCAST_ID = 0xFE  # OW_BROADCAST_ID of the firmware
+ONE_WIRE_MAX_READ_SIZE = 253  # status packet length byte is data size + 2
+ONE_WIRE_MAX_LENGTH = 255
+OW_PORT_TIMEOUT_TOLERANCE = 0.25  # relative
 
 class OneWireException(Exception):
     pass
@@ -36,6 +46,25 @@ class OneWireMasterInterface:
         self.serial.baudrate = baudrate
         assert timeout is not None  # do not allow blocking mode
         self.serial.timeout = timeout
+        self.timeout = timeout  # upper bound of every transaction timeout
+        self.timeout_model = OneWireTimeoutModel()
+        self.parser = OneWireFrameParser()
+        self._tx_buffer = memoryview(bytearray(ONE_WIRE_MAX_FRAME_SIZE))
+        # Held for each transaction so that threads sharing the interface do
+        # not interleave on the port (see OneWireRequestQueue for priorities)
+        self.lock = threading.RLock()
+        # Per-transaction hooks:
+        #   pre_send(device_id, instruction, frame), frame is only valid
+        #       during the call
+        #   post_receive(device_id, instruction, status, data, elapsed)
+        #   on_error(device_id, instruction, exception, elapsed)
+        # post_receive is also called for requests without answer, with a
+        # status of 0 and empty data.
+        self.pre_send_hooks = []
+        self.post_receive_hooks = []
+        self.error_hooks = []
+        self.metrics = OneWireMetrics(
+            {v: k for k, v in self.Instructions.items()})  # None disables
 
     def open(self, port=None, baudrate=None, timeout=None):
         if port is not None:
@@ -44,6 +73,7 @@ class OneWireMasterInterface:
             self.serial.baudrate = baudrate
         if timeout is not None:
             self.serial.timeout = timeout
+            self.timeout = timeout
         self.serial.open()
 
     def close(self):
@@ -53,12 +83,26 @@ class OneWireMasterInterface:
         return self.serial.isOpen()
 
     def setBaudrate(self, baudrate):
-        if self.isOpen():
-            self.serial.close()
-            self.serial.baudrate = baudrate
-            self.serial.open()
-        else:
-            self.serial.baudrate = baudrate
+        # Not while another thread is in a transaction (pollers, queue)
+        with self.lock:
+            if self.isOpen():
+                self.serial.close()
+                self.serial.baudrate = baudrate
+                self.serial.open()
+            else:
+                self.serial.baudrate = baudrate
+
+    def learnReturnDelayTime(self, device_id: int) -> int:
+        """ Reads the "Return delay time" register (address 5) of a device and
+            feeds it to the timeout model
+        """
+        err, rdt = self.readU8(device_id, 5)
+        self.timeout_model.setReturnDelayTime(device_id, rdt)
+        return err
+
+    def transactionTimeout(self, device_id: int, request_size: int, answer_size: int) -> float:
+        return self.timeout_model.timeout(device_id, request_size, answer_size,
+                                          self.serial.baudrate, self.timeout)
 
     def readU8(self, device_id: int, addr: int) -> Tuple[int, int]:
         return self._read(device_id, addr, "<B")
@@ -69,6 +113,27 @@ class OneWireMasterInterface:
     def readU32(self, device_id: int, addr: int) -> Tuple[int, int]:
         return self._read(device_id, addr, "<I")
 
+    def readBlock(self, device_id: int, addr: int, length: int) -> Tuple[int, bytes]:
+        p = self._readRequest(device_id, addr, length)
+        return self._transaction(p, True, length)
+
+    def prepareRead(self, device_id: int, addr: int, length: int) -> OneWirePreparedRequest:
+        p = self._readRequest(device_id, addr, length)
+        return OneWirePreparedRequest(p, device_id != ONE_WIRE_BROADCAST_ID, length)
+
+    def preparePing(self, device_id: int) -> OneWirePreparedRequest:
+        p = OneWirePacket(device_id, self.Instructions["PING"])
+        return OneWirePreparedRequest(p, True)
+
+    def execute(self, request: OneWirePreparedRequest) -> Tuple[int, bytes]:
+        answer_size = OW_STATUS_OVERHEAD
+        if request.answer_size is not None:
+            answer_size += request.answer_size
+        with self.lock:
+            return self._exchange(request.id, request.instruction, request.frame,
+                                  request.expect_answer, answer_size,
+                                  request.answer_size)
+
     def writeU8(self, device_id: int, addr: int, data: int, expect_answer: bool = True) -> Optional[int]:
         return self._write(device_id, addr, data, "<B", expect_answer)
 
@@ -78,18 +143,47 @@ class OneWireMasterInterface:
     def writeU32(self, device_id: int, addr: int, data: int, expect_answer: bool = True) -> Optional[int]:
         return self._write(device_id, addr, data, "<I", expect_answer)
 
-    def regWrite(self, device_id: int, addr: int, data: int, expect_answer: bool = True) -> Optional[int]:
-        pass
+    def writeBlock(self, device_id: int, addr: int, data: bytes, expect_answer: bool = True) -> Optional[int]:
+        if not 0 < len(data) <= ONE_WIRE_MAX_LENGTH - 3:
+            raise ValueError("Invalid block length: " + str(len(data)))
+        p = self._writeRequest(device_id, addr, data)
+        err, _ = self._transaction(p, expect_answer)
+        if expect_answer:
+            return err
+        else:
+            return None
+
+    def regWrite(self, device_id: int, addr: int, data: bytes, expect_answer: bool = True) -> Optional[int]:
+        p = self._writeRequest(device_id, addr, data, "REG_WRITE")
+        err, _ = self._transaction(p, expect_answer)
+        if expect_answer:
+            return err
+        else:
+            return None
+
+    def syncWrite(self, id_list: List[int], addr: int, data_list: List[bytes]) -> None:
+        self._transaction(self._syncWriteRequest(id_list, addr, data_list), False)
+
+    def syncWriteU8(self, id_list: List[int], addr: int, values: List[int]) -> None:
+        self.syncWrite(id_list, addr, [struct.pack("<B", v) for v in values])
 
-    def syncWrite(self, id_list: List[int], addr: int, data: int) -> None:
-        pass
+    def syncWriteU16(self, id_list: List[int], addr: int, values: List[int]) -> None:
+        self.syncWrite(id_list, addr, [struct.pack("<H", v) for v in values])
+
+    def syncWriteU32(self, id_list: List[int], addr: int, values: List[int]) -> None:
+        self.syncWrite(id_list, addr, [struct.pack("<I", v) for v in values])
 
     def ping(self, device_id: int) -> int:
         p = OneWirePacket(device_id, self.Instructions["PING"])
         return self._transaction(p, True)[0]
 
     def action(self, device_id: int, expect_answer: bool = True) -> Optional[int]:
-        pass
+        p = OneWirePacket(device_id, self.Instructions["ACTION"])
+        err, _ = self._transaction(p, expect_answer)
+        if expect_answer:
+            return err
+        else:
+            return None
 
     def factoryReset(self, device_id: int, expect_answer: bool = True) -> Optional[int]:
         p = OneWirePacket(device_id, self.Instructions["FACTORY_RESET"])
@@ -108,52 +202,160 @@ class OneWireMasterInterface:
             return None
 
     def _read(self, device_id: int, addr: int, data_format: str) -> Tuple[int, int]:
-        p = OneWirePacket(device_id, self.Instructions["READ"])
-        p.address = addr
-        p.data.append(struct.calcsize(data_format))
-        err, data = self._transaction(p, True)
-        if len(data) == 0:
-            raise OneWireDataMissing
-        try:
-            val, = struct.unpack(data_format, data)
-        except struct.error:
-            raise OneWireComError
-        return err, val
+        err, data = self.readBlock(device_id, addr, struct.calcsize(data_format))
+        return err, self._unpack(data, data_format)
 
     def _write(self, device_id: int, addr: int, data: int, data_format: str, expect_answer: bool) -> Optional[int]:
-        p = OneWirePacket(device_id, self.Instructions["WRITE"])
-        p.address = addr
-        p.data = struct.pack(data_format, data)
+        p = self._writeRequest(device_id, addr, struct.pack(data_format, data))
         err, _ = self._transaction(p, expect_answer)
         if expect_answer:
             return err
         else:
             return None
 
-    def _transaction(self, packet: OneWirePacket, expect_answer: bool) -> Tuple[int, bytes]:
-        self._sendPacket(packet)
-        if expect_answer and packet.id != ONE_WIRE_BROADCAST_ID:
-            return self._receivePacket(packet.id)
-        return 0, bytes()
-
-    def _sendPacket(self, packet: OneWirePacket) -> None:
-        self.serial.write(bytes([0xFF, 0xFF]))
-        self.serial.write(packet.toBytes())
-
-    def _receivePacket(self, expected_id: int) -> Tuple[int, bytes]:
-        header = self.serial.read(4)
-        if len(header) != 4:
-            raise OneWireTimeout
-        if header[0] != 0xFF or header[1] != 0xFF:
-            raise OneWireComError
-        if header[2] != expected_id:
+    @classmethod
+    def _readRequest(cls, device_id: int, addr: int, length: int) -> OneWirePacket:
+        if not 0 < length <= ONE_WIRE_MAX_READ_SIZE:
+            raise ValueError("Invalid block length: " + str(length))
+        p = OneWirePacket(device_id, cls.Instructions["READ"])
+        p.address = addr
+        p.data.append(length)
+        return p
+
+    @classmethod
+    def _writeRequest(cls, device_id: int, addr: int, data: bytes, instruction: str = "WRITE") -> OneWirePacket:
+        p = OneWirePacket(device_id, cls.Instructions[instruction])
+        p.address = addr
+        p.data = bytearray(data)
+        return p
+
+    @classmethod
+    def _syncWriteRequest(cls, id_list: List[int], addr: int, data_list: List[bytes]) -> OneWirePacket:
+        if len(id_list) == 0 or len(id_list) != len(data_list):
+            raise ValueError("id_list and data_list must have the same non-zero length")
+        size = len(data_list[0])
+        if size == 0 or (size + 1) * len(id_list) + 4 > ONE_WIRE_MAX_LENGTH:
+            raise ValueError("Invalid SYNC_WRITE payload size")
+        p = OneWirePacket(ONE_WIRE_BROADCAST_ID, cls.Instructions["SYNC_WRITE"])
+        p.address = addr
+        p.data.append(size)
+        for device_id, data in zip(id_list, data_list):
+            if not 0 <= device_id < ONE_WIRE_BROADCAST_ID:
+                raise ValueError("Invalid SYNC_WRITE device ID: " + str(device_id))
+            if len(data) != size:
+                raise ValueError("All SYNC_WRITE payloads must have the same size")
+            p.data.append(device_id)
+            p.data += data
+        return p
+
+    @staticmethod
+    def _checkReadAnswer(data: bytes, length: int) -> bytes:
+        if len(data) == 0:
+            raise OneWireDataMissing
+        if len(data) != length:
             raise OneWireComError
-        if header[3] < 2:
+        return data
+
+    @staticmethod
+    def _unpack(data: bytes, data_format: str) -> int:
+        try:
+            val, = struct.unpack(data_format, data)
+        except struct.error:
             raise OneWireComError
-        data = self.serial.read(header[3])
-        if len(data) != header[3]:
-            raise OneWireTimeout
-        status = data[0]
-        if data[-1] != OneWirePacket.checksum(header[2:] + data[:-1]):
-            raise OneWireChecksumError
-        return status, data[1:-1]
+        return val
+
+    def _transaction(self, packet: OneWirePacket, expect_answer: bool,
+                     read_length: int = None) -> Tuple[int, bytes]:
+        with self.lock:
+            size = packet.encodeInto(self._tx_buffer)
+            return self._exchange(packet.id, packet.instruction,
+                                  self._tx_buffer[:size],
+                                  expect_answer and packet.id != ONE_WIRE_BROADCAST_ID,
+                                  self._expectedAnswerSize(packet), read_length)
+
+    def _exchange(self, device_id: int, instruction: int, frame, expect_answer: bool,
+                  answer_size: int, read_length: Optional[int]) -> Tuple[int, bytes]:
+        for hook in self.pre_send_hooks:
+            hook(device_id, instruction, frame)
+        start = time.monotonic()
+        try:
+            if expect_answer:
+                # Late bytes of a timed out answer would be taken for this one
+                self.serial.reset_input_buffer()
+            self.serial.write(frame)
+            if expect_answer:
+                err, data = self._receivePacket(device_id, len(frame), answer_size)
+                if read_length is not None:
+                    self._checkReadAnswer(data, read_length)
+            else:
+                err, data = 0, bytes()
+        except (OneWireException, IOError) as e:
+            # IOError: the port failed (unplugged adapter...)
+            self._notifyError(device_id, instruction, e, time.monotonic() - start)
+            raise
+        self._notifyAnswer(device_id, instruction, err, data, time.monotonic() - start)
+        return err, data
+
+    def _notifyAnswer(self, device_id: int, instruction: int, status: int,
+                      data: bytes, elapsed: float):
+        if self.metrics is not None:
+            self.metrics.recordAnswer(device_id, instruction, status, elapsed)
+        for hook in self.post_receive_hooks:
+            hook(device_id, instruction, status, data, elapsed)
+
+    def _notifyError(self, device_id: int, instruction: int,
+                     error: Exception, elapsed: float):
+        if self.metrics is not None:
+            self.metrics.recordError(device_id, instruction, error, elapsed)
+        for hook in self.error_hooks:
+            hook(device_id, instruction, error, elapsed)
+
+    def _receivePacket(self, expected_id: int, request_size: int, answer_size: int) -> Tuple[int, bytes]:
+        parser = self.parser
+        parser.reset()  # drop what is left of a previous, failed, transaction
+        checksum_errors = parser.checksum_errors
+        timeout = self.transactionTimeout(expected_id, request_size, answer_size)
+        self._setPortTimeout(timeout)
+        start = time.monotonic()
+        deadline = start + timeout
+        overdue = False
+        while True:
+            size = parser.bytesNeeded()
+            data = self.serial.read(size)
+            for frame in parser.feed(data):
+                if frame.id != expected_id:
+                    raise OneWireComError
+                self.timeout_model.observe(expected_id, request_size, answer_size,
+                                           self.serial.baudrate, time.monotonic() - start)
+                return frame.instruction, frame.data
+            if parser.checksum_errors != checksum_errors and \
+                    parser.last_checksum_error_id == expected_id and \
+                    parser.pending() == 0:
+                raise OneWireChecksumError
+            if time.monotonic() > deadline:
+                if not overdue and self.serial.in_waiting > 0:
+                    # The answer came in while this thread was not scheduled
+                    overdue = True
+                    deadline = time.monotonic() + self.serial.timeout
+                    continue
+                self.timeout_model.timedOut(expected_id)
+                raise OneWireTimeout
+
+    def _setPortTimeout(self, timeout: float):
+        """ Changing the timeout of an open port reconfigures it (one system
+            call), so the port timeout only follows the transaction timeout
+            in whole milliseconds, and only when they differ by more than
+            OW_PORT_TIMEOUT_TOLERANCE; the read loop enforces the exact
+            deadline
+        """
+        timeout = math.ceil(timeout * 1000) / 1000
+        current = self.serial.timeout
+        if current is None or \
+                abs(current - timeout) > OW_PORT_TIMEOUT_TOLERANCE * timeout:
+            self.serial.timeout = timeout
+
+    @classmethod
+    def _expectedAnswerSize(cls, packet: OneWirePacket) -> int:
+        if packet.instruction == cls.Instructions["READ"] and len(packet.data) > 0:
+            return OW_STATUS_OVERHEAD + packet.data[0]
+        return OW_STATUS_OVERHEAD
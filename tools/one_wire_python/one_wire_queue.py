@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+OW_PRIORITY_CONTROL = 0  # writes driving actuators
+OW_PRIORITY_NORMAL = 1  # user requests (GUI buttons...)
+OW_PRIORITY_TELEMETRY = 2  # periodic reads
+OW_PRIORITY_NAMES = {
+    OW_PRIORITY_CONTROL: "control",
+    OW_PRIORITY_NORMAL: "normal",
+    OW_PRIORITY_TELEMETRY: "telemetry",
+}
+
+
+class OneWireQueueStats:
+    __slots__ = ("submitted", "started", "cancelled", "wait_sum", "wait_max")
+
+    def __init__(self):
+        self.submitted = 0
+        self.started = 0
+        self.cancelled = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+
+class OneWireRequestQueue:
+    """ Serializes the use of one bus between several producers
+
+        Requests are callables executed one at a time by a single worker
+        thread, lowest priority value first, in submission order within a
+        priority. A request already running is never interrupted: a control
+        write waits at most for the end of the current transaction. Each
+        request gets a concurrent.futures.Future; cancelling it before it
+        starts removes it from the queue.
+
+        The queue depth and the time spent waiting in the queue are tracked
+        per priority (stats(), prometheus()).
+    """
+    def __init__(self, name: str = "OneWire"):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {p: OneWireQueueStats() for p in OW_PRIORITY_NAMES}
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="OneWireQueue-" + name)
+        self._thread.start()
+
+    def submit(self, fn, *args, priority: int = OW_PRIORITY_NORMAL) -> Future:
+        future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Request queue is stopped")
+            heapq.heappush(self._heap, (priority, next(self._counter),
+                                        time.monotonic(), future, fn, args))
+            self._stats.setdefault(priority, OneWireQueueStats()).submitted += 1
+            self._condition.notify()
+        return future
+
+    def depth(self, priority: Optional[int] = None) -> int:
+        with self._condition:
+            # Cancelled requests stay in the heap until the worker pops them
+            return sum(1 for r in self._heap if not r[3].cancelled() and
+                       (priority is None or r[0] == priority))
+
+    def stop(self, wait: bool = True) -> None:
+        """ Cancels the requests not started yet and stops the worker """
+        with self._condition:
+            self._stopped = True
+            for r in self._heap:
+                r[3].cancel()
+            self._heap.clear()
+            self._condition.notify()
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def stats(self) -> dict:
+        """ :returns:
+                {priority_name: {"depth", "submitted", "started",
+                "cancelled", "wait_mean", "wait_max"}}, times in seconds
+        """
+        out = {}
+        with self._condition:
+            depths = {}
+            for r in self._heap:
+                if not r[3].cancelled():
+                    depths[r[0]] = depths.get(r[0], 0) + 1
+            for p, s in sorted(self._stats.items()):
+                done = s.started + s.cancelled
+                out[OW_PRIORITY_NAMES.get(p, str(p))] = {
+                    "depth": depths.get(p, 0),
+                    "submitted": s.submitted,
+                    "started": s.started,
+                    "cancelled": s.cancelled,
+                    "wait_mean": s.wait_sum / done if done > 0 else 0.0,
+                    "wait_max": s.wait_max,
+                }
+        return out
+
+    def prometheus(self, labels: Optional[dict] = None) -> str:
+        """ Exports the statistics in the Prometheus text exposition format
+
+            :param labels: extra labels added to every sample (e.g. bus)
+        """
+        extra = "".join('{}="{}",'.format(k, v)
+                        for k, v in sorted((labels or {}).items()))
+        families = [
+            ("onewire_queue_depth", "gauge", "depth",
+             "Requests waiting in the queue."),
+            ("onewire_queue_requests_total", "counter", "submitted",
+             "Requests submitted to the queue."),
+            ("onewire_queue_wait_seconds_max", "gauge", "wait_max",
+             "Longest wait of a request before it started."),
+        ]
+        stats = self.stats()
+        lines = []
+        for metric, metric_type, key, description in families:
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, metric_type))
+            for name, s in stats.items():
+                lines.append('{}{{{}queue="{}",priority="{}"}} {}'.format(
+                    metric, extra, self.name, name, s[key]))
+        return "\n".join(lines) + "\n"
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._heap) == 0 and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                priority, _, submitted, future, fn, args = \
+                    heapq.heappop(self._heap)
+                s = self._stats[priority]
+                wait = time.monotonic() - submitted
+                s.wait_sum += wait
+                s.wait_max = max(s.wait_max, wait)
+                if future.set_running_or_notify_cancel():
+                    s.started += 1
+                else:
+                    s.cancelled += 1
+                    continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from one_wire_def import OW_BAUDRATE
+from one_wire_python import (OneWireMasterInterface, OneWireException,
+                             ONE_WIRE_BROADCAST_ID)
+from one_wire_timing import (transaction_time, OW_STATUS_OVERHEAD,
+                             OW_MAX_RETURN_DELAY_TIME)
+
+"""
+OneWireScanResult: (port, baudrate, device_id, status, model, firmware)
+model and firmware are None when they could not be read (e.g. the device
+status return level does not allow READ answers).
+"""
+OneWireScanResult = namedtuple("OneWireScanResult", ["port", "baudrate",
+                                                     "device_id", "status",
+                                                     "model", "firmware"])
+
+OW_PING_REQUEST_SIZE = 6  # preamble, ID, length, instruction, checksum
+
+
+class OneWireScanner:
+    """ Discovers the devices present on one or several serial ports
+
+        Each port is scanned by its own thread. Every ID of every baudrate is
+        pinged with a timeout derived from the bus timing (worst case return
+        delay time plus host overhead), then tightened to a few times the
+        slowest answer observed so far on that port. The scan stops early
+        once 'expected_count' devices have been found over all ports.
+    """
+    def __init__(self, ports: List[str], baudrates: Optional[List[int]] = None,
+                 device_ids=range(ONE_WIRE_BROADCAST_ID),
+                 expected_count: Optional[int] = None,
+                 host_overhead: float = 0.02, latency_margin: float = 3.0):
+        self.ports = list(ports)
+        if baudrates is None:
+            baudrates = [b.hl_value for b in OW_BAUDRATE]
+        self.baudrates = list(baudrates)
+        self.device_ids = list(device_ids)
+        self.expected_count = expected_count
+        self.host_overhead = host_overhead
+        self.latency_margin = latency_margin
+        self.results = []  # type: List[OneWireScanResult]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def scan(self) -> List[OneWireScanResult]:
+        self.results = []
+        self._stop.clear()
+        if len(self.ports) > 0:
+            with ThreadPoolExecutor(max_workers=len(self.ports)) as executor:
+                for future in [executor.submit(self._scanPort, p)
+                               for p in self.ports]:
+                    future.result()
+        return sorted(self.results,
+                      key=lambda r: (r.port, -r.baudrate, r.device_id))
+
+    def stop(self):
+        self._stop.set()
+
+    def initialTimeout(self, baudrate: int) -> float:
+        return transaction_time(OW_PING_REQUEST_SIZE, OW_STATUS_OVERHEAD,
+                                baudrate, OW_MAX_RETURN_DELAY_TIME,
+                                self.host_overhead)
+
+    @staticmethod
+    def minimalTimeout(baudrate: int) -> float:
+        # Never go below the bus time of the slowest possible device
+        return transaction_time(OW_PING_REQUEST_SIZE, OW_STATUS_OVERHEAD,
+                                baudrate, OW_MAX_RETURN_DELAY_TIME)
+
+    def _scanPort(self, port: str):
+        ow = OneWireMasterInterface(port)
+        try:
+            ow.open()
+        except IOError:
+            return
+        try:
+            for baudrate in self.baudrates:
+                if self._stop.is_set():
+                    break
+                ow.setBaudrate(baudrate)
+                self._scanBaudrate(ow, port, baudrate)
+        except IOError:
+            pass
+        finally:
+            ow.close()
+
+    def _scanBaudrate(self, ow: OneWireMasterInterface, port: str,
+                      baudrate: int):
+        ow.timeout = self.initialTimeout(baudrate)
+        max_latency = 0.0
+        for device_id in self.device_ids:
+            if self._stop.is_set():
+                return
+            start = time.monotonic()
+            try:
+                status = ow.ping(device_id)
+            except OneWireException:
+                continue
+            max_latency = max(max_latency, time.monotonic() - start)
+            ow.timeout = max(self.minimalTimeout(baudrate),
+                             min(self.initialTimeout(baudrate),
+                                 max_latency * self.latency_margin))
+            model, firmware = self._identify(ow, device_id)
+            self._addResult(OneWireScanResult(port, baudrate, device_id,
+                                              status, model, firmware))
+
+    @staticmethod
+    def _identify(ow: OneWireMasterInterface, device_id: int):
+        # Model number (U16 at 0) and firmware version (U8 at 2) in one read
+        try:
+            _, data = ow.readBlock(device_id, 0, 3)
+        except OneWireException:
+            return None, None
+        return int.from_bytes(data[0:2], 'little'), data[2]
+
+    def _addResult(self, result: OneWireScanResult):
+        with self._lock:
+            self.results.append(result)
+            if self.expected_count is not None and \
+                    len(self.results) >= self.expected_count:
+                self._stop.set()
+
+
+def format_scan_results(results: List[OneWireScanResult]) -> str:
+    lines = ["{:<16} {:>8} {:>4} {:>6} {:>8}".format(
+        "Port", "Baudrate", "ID", "Model", "Firmware")]
+    for r in results:
+        lines.append("{:<16} {:>8} {:>4} {:>6} {:>8}".format(
+            r.port, r.baudrate, r.device_id,
+            "?" if r.model is None else r.model,
+            "?" if r.firmware is None else r.firmware))
+    return "\n".join(lines)
@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from typing import List, Optional
+
+from one_wire_python import OneWireMasterInterface, OneWireException
+from one_wire_timing import read_transaction_time, OW_MAX_RETURN_DELAY_TIME
+from reg_map.reg_map import get_register_area_span, decode_register_area
+
+"""
+OneWireSample: (timestamp, device_id, register_name, value, status, error)
+timestamp comes from time.monotonic(); on failure, value and status are None
+and error holds the OneWireException raised by the transaction.
+"""
+OneWireSample = namedtuple("OneWireSample", ["timestamp", "device_id",
+                                             "register_name", "value",
+                                             "status", "error"])
+
+
+class OneWireScheduleInfeasible(Exception):
+    pass
+
+
+class OneWirePollGroup:
+    """ Registers of one device polled at the same rate, fetched with a single
+        block read
+    """
+    def __init__(self, device_id: int, rate: float, registers: list,
+                 cost: float):
+        self.device_id = device_id
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.registers = registers
+        self.start, self.length = get_register_area_span(registers)
+        self.cost = cost
+        self.request = None
+        self.next_due = 0.0
+        self.overruns = 0
+
+
+class OneWireSchedulePlan:
+    def __init__(self, groups: List[OneWirePollGroup], max_utilization: float):
+        self.groups = groups
+        self.max_utilization = max_utilization
+        self.utilization = sum(g.cost * g.rate for g in groups)
+
+    @property
+    def feasible(self) -> bool:
+        return self.utilization <= self.max_utilization
+
+    def report(self) -> str:
+        lines = ["Bus utilization: {:.1%} (max {:.1%})".format(
+            self.utilization, self.max_utilization)]
+        for g in self.groups:
+            lines.append("  ID {:3d} @ {:g} Hz, {} byte(s) at {}: {:.1%} ({})"
+                         .format(g.device_id, g.rate, g.length, hex(g.start),
+                                 g.cost * g.rate,
+                                 ", ".join(r[2] for r in g.registers)))
+        return "\n".join(lines)
+
+
+class OneWirePollingScheduler:
+    """ Headless scheduler polling registers at fixed rates
+
+        Subscriptions of a device sharing the same rate are merged into one
+        block read. The plan is checked against the bus budget (baudrate,
+        return delay time, host overhead) before starting; at run time the
+        group with the earliest deadline is always polled first. Samples are
+        published to 'callback' and/or put in 'sample_queue'.
+
+        The return delay time of each device is the one known by the timeout
+        model of the interface; start() reads it from the devices where it
+        is unknown, 'return_delay_time' being assumed when that fails. After
+        an IOError the polling thread ends and isRunning() returns False.
+    """
+    def __init__(self, ow_interface: OneWireMasterInterface,
+                 return_delay_time: int = OW_MAX_RETURN_DELAY_TIME,
+                 host_overhead: float = 0.001,
+                 max_utilization: float = 0.9, callback=None,
+                 sample_queue=None):
+        self.ow_interface = ow_interface
+        self.return_delay_time = return_delay_time
+        self.host_overhead = host_overhead
+        self.max_utilization = max_utilization
+        self.callback = callback
+        self.sample_queue = sample_queue
+        self._subscriptions = OrderedDict()
+        self._plan = None  # type: Optional[OneWireSchedulePlan]
+        self._thread = None
+        self._stop = threading.Event()
+        self.io_error = None
+
+    def subscribe(self, device_id: int, register_entry: tuple, rate: float):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self._subscriptions[(device_id, register_entry[0])] = \
+            (device_id, register_entry, rate)
+        self._plan = None
+
+    def unsubscribe(self, device_id: int, register_entry: tuple):
+        self._subscriptions.pop((device_id, register_entry[0]), None)
+        self._plan = None
+
+    def plan(self) -> OneWireSchedulePlan:
+        baudrate = self.ow_interface.serial.baudrate
+        merged = OrderedDict()
+        for device_id, entry, rate in self._subscriptions.values():
+            merged.setdefault((device_id, rate), []).append(entry)
+        return_delay_times = self.ow_interface.timeout_model.return_delay_times
+        groups = []
+        for (device_id, rate), registers in merged.items():
+            registers.sort(key=lambda e: e[0])
+            _, length = get_register_area_span(registers)
+            rdt = return_delay_times.get(device_id, self.return_delay_time)
+            cost = read_transaction_time(length, baudrate, rdt,
+                                         self.host_overhead)
+            groups.append(OneWirePollGroup(device_id, rate, registers, cost))
+        self._plan = OneWireSchedulePlan(groups, self.max_utilization)
+        return self._plan
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self._learnReturnDelayTimes():
+            self._plan = None
+        plan = self._plan if self._plan is not None else self.plan()
+        if not plan.feasible:
+            raise OneWireScheduleInfeasible(plan.report())
+        now = time.monotonic()
+        for g in plan.groups:
+            g.request = self.ow_interface.prepareRead(g.device_id, g.start,
+                                                      g.length)
+            g.next_due = now
+        self._stop.clear()
+        self.io_error = None
+        self._thread = threading.Thread(target=self._run, args=(plan,),
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            self._thread = None
+
+    def isRunning(self) -> bool:
+        return self._thread is not None
+
+    def _learnReturnDelayTimes(self) -> bool:
+        """ Reads the return delay time of the subscribed devices for which
+            the timeout model does not know it
+
+            :returns: True if any was learned
+        """
+        ow = self.ow_interface
+        learned = False
+        for device_id in OrderedDict.fromkeys(
+                s[0] for s in self._subscriptions.values()):
+            if device_id in ow.timeout_model.return_delay_times:
+                continue
+            try:
+                ow.learnReturnDelayTime(device_id)
+                learned = True
+            except OneWireException:
+                pass
+        return learned
+
+    def _run(self, plan: OneWireSchedulePlan):
+        try:
+            self._loop(plan.groups)
+        finally:
+            if self._thread is threading.current_thread():
+                self._thread = None
+
+    def _loop(self, groups: List[OneWirePollGroup]):
+        if len(groups) == 0:
+            return
+        while not self._stop.is_set():
+            g = min(groups, key=lambda x: x.next_due)
+            delay = g.next_due - time.monotonic()
+            if delay > 0:
+                if self._stop.wait(delay):
+                    break
+            self._poll(g)
+            g.next_due += g.period
+            now = time.monotonic()
+            if g.next_due + g.period < now:
+                # Missed a full period: skip it instead of bursting
+                g.overruns += 1
+                g.next_due = now
+
+    def _poll(self, g: OneWirePollGroup):
+        try:
+            status, data = self.ow_interface.execute(g.request)
+            values = decode_register_area(g.registers, g.start, data)
+            error = None
+        except IOError as e:
+            # Connection lost: stop polling, the owner checks io_error
+            self.io_error = e
+            self._stop.set()
+            return
+        except OneWireException as e:
+            status = None
+            values = [None] * len(g.registers)
+            error = e
+        timestamp = time.monotonic()
+        for entry, value in zip(g.registers, values):
+            self._publish(OneWireSample(timestamp, g.device_id, entry[2],
+                                        value, status, error))
+
+    def _publish(self, sample: OneWireSample):
+        if self.callback is not None:
+            self.callback(sample)
+        if self.sample_queue is not None:
+            self.sample_queue.put(sample)
@@ -0,0 +1,142 @@
+from typing import List, Optional, Tuple
+
+from one_wire_python import (OneWireMasterInterface, OneWireException,
+                             ONE_WIRE_MAX_LENGTH)
+from reg_map.reg_map import compile_register_map
+
+OW_WRITE_ERROR_MASK = 88  # range, checksum and instruction errors
+
+
+class OneWireRegisterShadow:
+    """ Host-side copy of the registers of one device
+
+        Cache rules:
+        - read-only EEPROM registers (model number, firmware version...) are
+          read once and then served from the cache;
+        - other registers are read from the device on every read(), unless
+          'cached=True' is given;
+        - write() only records the value, flush() sends every pending write
+          as merged contiguous WRITE packets; a write of the value already
+          known for the register is skipped;
+        - a write which fails or times out makes the registers it targeted
+          unknown (the device may have applied it), they stay pending;
+        - softReset() forgets every value except the read-only EEPROM ones;
+          factoryReset() forgets every value, and the device ID too since the
+          device may be back to its default ID and baudrate: give the new ID
+          to factoryReset() or set 'device_id' afterwards; both drop the
+          pending writes;
+        - transactions made with the interface without going through the
+          shadow are not seen: call invalidate() after them.
+    """
+    def __init__(self, ow_interface: OneWireMasterInterface, device_id: int,
+                 register_map, expect_answer: bool = True):
+        self.ow_interface = ow_interface
+        self.device_id = device_id
+        self.register_map = compile_register_map(register_map)
+        self.expect_answer = expect_answer
+        self.values = {}  # address -> value known to be in the device
+        self._pending = {}  # address -> value to be written
+        self._read_only_eeprom = set(r.address for r in self.register_map.eeprom
+                                     if not r.writable)
+
+    def entry(self, name: str) -> tuple:
+        return self.register_map.by_name[name]
+
+    def read(self, name: str, cached: bool = False) -> int:
+        r = self.register_map.by_name[name]
+        if r.address in self.values and \
+                (cached or r.address in self._read_only_eeprom):
+            return self.values[r.address]
+        _, data = self.ow_interface.readBlock(self._deviceId(), r.address,
+                                              r.size)
+        value = r.decode(data)
+        self.values[r.address] = value
+        return value
+
+    def refresh(self) -> None:
+        """ Reads every register with one block read per area """
+        for area in self.register_map.areas():
+            _, data = self.ow_interface.readBlock(self._deviceId(), area.start,
+                                                  area.length)
+            for r, value in zip(area, area.decode(data).values()):
+                self.values[r.address] = value
+
+    def write(self, name: str, value: int) -> None:
+        r = self.register_map.by_name[name]
+        r.validate(value)
+        if self.values.get(r.address) == value:
+            self._pending.pop(r.address, None)
+        else:
+            self._pending[r.address] = value
+
+    def dirty(self) -> List[str]:
+        return [e[2] for e in self._entries(sorted(self._pending))]
+
+    def flush(self) -> List[Tuple[int, int, Optional[int]]]:
+        """ Sends the pending writes
+
+            :returns:
+                [(address, size, device_status), ...] for each WRITE packet
+        """
+        result = []
+        for start, data, entries in self._mergePending():
+            try:
+                err = self.ow_interface.writeBlock(self._deviceId(), start,
+                                                   data, self.expect_answer)
+            except (OneWireException, IOError):
+                for e in entries:
+                    self.values.pop(e[0], None)
+                raise
+            result.append((start, len(data), err))
+            for e in entries:
+                value = self._pending.pop(e[0])
+                if err is not None and err & OW_WRITE_ERROR_MASK:
+                    self.values.pop(e[0], None)
+                else:
+                    self.values[e[0]] = value
+                    if e[2] == "Device ID":
+                        self.device_id = value
+        return result
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        if name is None:
+            self.values.clear()
+        else:
+            self.values.pop(self.register_map.by_name[name].address, None)
+
+    def softReset(self) -> Optional[int]:
+        err = self.ow_interface.softReset(self._deviceId(), self.expect_answer)
+        self._pending.clear()
+        self.values = {a: v for a, v in self.values.items()
+                       if a in self._read_only_eeprom}
+        return err
+
+    def factoryReset(self, new_id: Optional[int] = None) -> Optional[int]:
+        """ :param new_id: ID of the device after the reset, if known """
+        err = self.ow_interface.factoryReset(self._deviceId(),
+                                             self.expect_answer)
+        self._pending.clear()
+        self.values.clear()
+        self.device_id = new_id
+        return err
+
+    def _deviceId(self) -> int:
+        if self.device_id is None:
+            raise RuntimeError("Device ID unknown since the factory reset")
+        return self.device_id
+
+    def _entries(self, addresses) -> list:
+        return [self.register_map.by_address[a] for a in addresses]
+
+    def _mergePending(self):
+        """ Groups the pending writes into runs of adjacent registers """
+        runs = []
+        for e in self._entries(sorted(self._pending)):
+            data = self._pending[e[0]].to_bytes(e[1], 'little')
+            if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == e[0] and \
+                    len(runs[-1][1]) + e[1] <= ONE_WIRE_MAX_LENGTH - 3:
+                runs[-1][1].extend(data)
+                runs[-1][2].append(e)
+            else:
+                runs.append((e[0], bytearray(data), [e]))
+        return runs
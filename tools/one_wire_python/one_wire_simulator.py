@@ -0,0 +1,341 @@
+import random
+import threading
+import time
+from typing import List, Optional
+
+from one_wire_def import OW_BAUDRATE
+from one_wire_packet import OneWirePacket, ONE_WIRE_PREAMBLE
+from one_wire_python import OneWireMasterInterface
+from one_wire_timing import frame_time, OW_RDT_UNIT
+
+OW_BROADCAST_ID = 0xFE  # as defined by the firmware (OneWireInterface.h)
+OW_S_RANGE_ERROR = 8
+OW_S_CHECKSUM_ERROR = 16
+OW_S_INSTRUCTION_ERROR = 64
+
+
+class VirtualOneWireDevice:
+    """ Software slave reproducing the behaviour of OneWireSInterface
+        (handleNewPacket) on top of a register file described by a reg_map
+
+        The ID, return delay time, status return level and baudrate are read
+        from the "Device ID", "Return delay time", "Status return level" and
+        "Baudrate" registers, so writing them has the same effect as on a
+        real device. 'hardware_status' is OR-ed into every status byte.
+    """
+    Instructions = OneWireMasterInterface.Instructions
+
+    def __init__(self, register_map, device_id: int = 1,
+                 model_number: int = 0, firmware_version: int = 1,
+                 return_delay_time: int = 0, status_return_level: int = 2,
+                 baudrate: int = 400000, values: Optional[dict] = None):
+        self.register_map = register_map
+        self.registers = register_map[1] + register_map[2]
+        self._by_name = {e[2]: e for e in self.registers}
+        self.memory = bytearray(256)
+        self.hardware_status = 0
+        self._reg_write = None
+        self.defaults = {e[2]: e[4] for e in self.registers}
+        self.defaults.update({
+            "Model number": model_number,
+            "Firmware version": firmware_version,
+            "Device ID": device_id,
+            "Return delay time": return_delay_time,
+            "Status return level": status_return_level,
+        })
+        for b in OW_BAUDRATE:
+            if b.hl_value == baudrate:
+                self.defaults["Baudrate"] = b.ll_value
+        if values is not None:
+            self.defaults.update(values)
+        self._loadDefaults(self.registers)
+
+    def get(self, name: str) -> int:
+        e = self._by_name[name]
+        return int.from_bytes(self.memory[e[0]:e[0] + e[1]], 'little')
+
+    def set(self, name: str, value: int) -> None:
+        e = self._by_name[name]
+        self.memory[e[0]:e[0] + e[1]] = int(value).to_bytes(e[1], 'little')
+
+    @property
+    def id(self) -> int:
+        return self.get("Device ID")
+
+    @property
+    def return_delay_time(self) -> float:
+        return self.get("Return delay time") * OW_RDT_UNIT
+
+    @property
+    def status_return_level(self) -> int:
+        if "Status return level" in self._by_name:
+            return self.get("Status return level")
+        return 2
+
+    @property
+    def baudrate(self) -> Optional[int]:
+        if "Baudrate" not in self._by_name:
+            return None
+        code = self.get("Baudrate")
+        for b in OW_BAUDRATE:
+            if b.ll_value == code:
+                return b.hl_value
+        return None
+
+    def handlePacket(self, frame: bytes) -> Optional[bytes]:
+        """ Handles one instruction frame (from the ID to the checksum)
+
+            :returns:
+                The status frame to send back, preamble included, or None
+        """
+        device_id = frame[0]
+        instruction = frame[2]
+        length = len(frame) + 2  # preamble included, as in OneWireSInterface
+        ins = self.Instructions
+        if device_id != self.id and device_id != OW_BROADCAST_ID:
+            return None
+
+        if device_id == OW_BROADCAST_ID:
+            answer = False
+        elif instruction == ins["PING"]:
+            answer = True
+        elif instruction == ins["READ"]:
+            answer = self.status_return_level != 0
+        else:
+            answer = self.status_return_level == 2
+
+        if frame[-1] != OneWirePacket.checksum(frame[:-1]):
+            if answer:
+                return self._status(device_id, OW_S_CHECKSUM_ERROR)
+            return None
+
+        data = b""
+        err = 0
+        instruction_ok = False
+        if instruction == ins["PING"]:
+            instruction_ok = length == 6
+        elif instruction == ins["READ"]:
+            if length == 8:
+                instruction_ok = True
+                addr, size = frame[3], frame[4]
+                data = bytes(self.memory[addr:addr + size])
+                data += bytes(size - len(data))
+        elif instruction == ins["WRITE"]:
+            if length > 7:
+                instruction_ok = True
+                err = self._write(frame[3], frame[4:-1])
+        elif instruction == ins["REG_WRITE"]:
+            if length > 7:
+                instruction_ok = True
+                self._reg_write = (frame[3], bytes(frame[4:-1]))
+        elif instruction == ins["ACTION"]:
+            if length == 6 and self._reg_write is not None:
+                instruction_ok = True
+                err = self._write(*self._reg_write)
+                self._reg_write = None
+        elif instruction == ins["FACTORY_RESET"]:
+            if length == 6:
+                instruction_ok = True
+                self._loadDefaults(self.registers)
+        elif instruction == ins["SOFT_RESET"]:
+            if length == 6:
+                instruction_ok = True
+                self._loadDefaults(self.register_map[2])
+        elif instruction == ins["SYNC_WRITE"]:
+            if length > 9 and (length - 8) % (frame[4] + 1) == 0:
+                instruction_ok = True
+                size = frame[4]
+                for i in range(5, len(frame) - 1, size + 1):
+                    if frame[i] == self.id:
+                        err = self._write(frame[3], frame[i + 1:i + 1 + size])
+                        break
+
+        if not answer:
+            return None
+        if not instruction_ok:
+            err |= OW_S_INSTRUCTION_ERROR
+        return self._status(device_id, err, data)
+
+    def _status(self, device_id: int, err: int, data: bytes = b"") -> bytes:
+        p = OneWirePacket(device_id, err | self.hardware_status)
+        p.data = bytearray(data)
+        return p.toFrame()
+
+    def _write(self, addr: int, data: bytes) -> int:
+        end = addr + len(data)
+        if end > len(self.memory):
+            return OW_S_RANGE_ERROR
+        new_memory = bytearray(self.memory)
+        new_memory[addr:end] = data
+        for e in self.registers:
+            if e[0] + e[1] <= addr or e[0] >= end:
+                continue
+            if not e[3]:
+                return OW_S_INSTRUCTION_ERROR
+            value = int.from_bytes(new_memory[e[0]:e[0] + e[1]], 'little')
+            if not e[4] <= value <= e[5]:
+                return OW_S_RANGE_ERROR
+        self.memory = new_memory
+        return 0
+
+    def _loadDefaults(self, registers) -> None:
+        for e in registers:
+            self.set(e[2], self.defaults[e[2]])
+
+
+class VirtualOneWireBus:
+    """ In-process pyserial-compatible loopback serving virtual devices
+
+        Bytes written by the master are split into frames the way
+        OneWireSInterface::handleNewByte does, and dispatched to every device
+        using the same baudrate. Answers become readable after the
+        transmission time of the request, the return delay time of the device
+        and the transmission time of the answer, all multiplied by
+        'time_scale' (0 makes the bus instantaneous).
+
+        Fault injection (probabilities per answer): 'drop_rate' loses the
+        answer, 'corrupt_rate' flips a bit of it, 'noise_rate' inserts a
+        stray byte before it.
+    """
+    def __init__(self, devices: List[VirtualOneWireDevice] = (),
+                 port: str = "virtual", baudrate: int = 400000,
+                 timeout: float = 0.1, time_scale: float = 1.0,
+                 drop_rate: float = 0.0, corrupt_rate: float = 0.0,
+                 noise_rate: float = 0.0, seed: Optional[int] = None):
+        self.devices = list(devices)
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.time_scale = time_scale
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.noise_rate = noise_rate
+        self.is_open = False
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self._random = random.Random(seed)
+        self._rx_buffer = bytearray()
+        self._scheduled = []  # [(ready_time, bytes), ...] in time order
+        self._tx_buffer = bytearray()
+        self._bus_free = 0.0
+        self._lock = threading.Lock()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    @property
+    def in_waiting(self) -> int:
+        with self._lock:
+            self._deliver(time.monotonic())
+            return len(self._rx_buffer)
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._rx_buffer.clear()
+            self._scheduled.clear()
+
+    def flush(self):
+        """ Waits until everything written has been transmitted """
+        with self._lock:
+            delay = self._bus_free - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise IOError("Port is closed")
+        data = bytes(data)
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._bus_free)
+            self._bus_free = start + self._scale(frame_time(len(data), self.baudrate))
+            self.bytes_written += len(data)
+            self._tx_buffer += data
+            for frame in self._splitFrames():
+                self._dispatch(frame)
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise IOError("Port is closed")
+        deadline = time.monotonic() + (self.timeout or 0)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._deliver(now)
+                if len(self._rx_buffer) >= size or now >= deadline:
+                    out = bytes(self._rx_buffer[:size])
+                    del self._rx_buffer[:size]
+                    self.bytes_read += len(out)
+                    return out
+                wait = deadline - now
+                if len(self._scheduled) > 0:
+                    wait = min(wait, self._scheduled[0][0] - now)
+            time.sleep(max(wait, 0))
+
+    def _scale(self, t: float) -> float:
+        return t * self.time_scale
+
+    def _deliver(self, now: float):
+        while len(self._scheduled) > 0 and self._scheduled[0][0] <= now:
+            self._rx_buffer += self._scheduled.pop(0)[1]
+
+    def _splitFrames(self):
+        buf = self._tx_buffer
+        frames = []
+        while True:
+            start = buf.find(ONE_WIRE_PREAMBLE)
+            if start < 0:
+                del buf[:max(0, len(buf) - 1)]
+                break
+            del buf[:start]
+            if len(buf) < 4:
+                break
+            if buf[2] == 0xFF or buf[3] < 2:
+                del buf[0]
+                continue
+            end = buf[3] + 4
+            if len(buf) < end:
+                break
+            frames.append(bytes(buf[2:end]))
+            del buf[:end]
+        return frames
+
+    def _dispatch(self, frame: bytes):
+        for device in self.devices:
+            if device.baudrate is not None and device.baudrate != self.baudrate:
+                continue
+            answer = device.handlePacket(frame)
+            if answer is None:
+                continue
+            if self._random.random() < self.drop_rate:
+                continue
+            if self._random.random() < self.corrupt_rate:
+                answer = bytearray(answer)
+                answer[self._random.randrange(2, len(answer))] ^= \
+                    1 << self._random.randrange(8)
+            if self._random.random() < self.noise_rate:
+                answer = bytes([self._random.randrange(256)]) + answer
+            ready = self._bus_free + self._scale(
+                device.return_delay_time +
+                frame_time(len(answer), self.baudrate))
+            self._bus_free = ready
+            self._scheduled.append((ready, bytes(answer)))
+            self._scheduled.sort(key=lambda x: x[0])
+
+
+def create_virtual_interface(devices: List[VirtualOneWireDevice],
+                             baudrate: int = 400000, timeout: float = 0.1,
+                             **bus_options) -> OneWireMasterInterface:
+    """ Returns an opened OneWireMasterInterface wired to a virtual bus """
+    ow = OneWireMasterInterface(baudrate=baudrate, timeout=timeout)
+    ow.serial = VirtualOneWireBus(devices, baudrate=baudrate, timeout=timeout,
+                                  **bus_options)
+    ow.serial.open()
+    return ow
@@ -0,0 +1,322 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import mmap
+import re
+import threading
+from array import array
+from os.path import join
+from typing import Dict, List, Optional, Tuple
+
+OW_SPILL_EXTENSION = ".owts"  # raw little endian (timestamp, value) doubles
+OW_SPILL_MIN_SIZE = 1 << 16  # bytes
+
+
+def _new_buffer(length: int):
+    if numpy is not None:
+        return numpy.zeros(length, dtype=numpy.float64)
+    return array('d', bytes(8 * length))
+
+
+def _concat(parts: list):
+    """ Joins buffers of doubles (numpy arrays or array('d')) """
+    if numpy is not None:
+        return numpy.concatenate(parts) if len(parts) > 0 \
+            else numpy.zeros(0, dtype=numpy.float64)
+    result = array('d')
+    for p in parts:
+        result.extend(p)
+    return result
+
+
+class OneWireSpillFile:
+    """ Memory-mapped file receiving the samples evicted from a ring buffer
+
+        Samples are stored as pairs of doubles (timestamp, value); the file
+        grows by doubling its size, the mapping being re-created each time.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'w+b')
+        self._file.truncate(OW_SPILL_MIN_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), OW_SPILL_MIN_SIZE)
+        self.size = 0  # bytes of samples written
+
+    def write(self, data) -> None:
+        data = memoryview(data).cast('B')
+        end = self.size + len(data)
+        if end > len(self._map):
+            new_size = len(self._map)
+            while new_size < end:
+                new_size *= 2
+            self._map.close()
+            self._file.truncate(new_size)
+            self._map = mmap.mmap(self._file.fileno(), new_size)
+        self._map[self.size:end] = data
+        self.size = end
+
+    def samples(self):
+        """ Flat buffer of every spilled (timestamp, value) pair """
+        if numpy is not None:
+            return numpy.frombuffer(self._map, dtype=numpy.float64,
+                                    count=self.size // 8).copy()
+        return array('d', self._map[:self.size])
+
+    def close(self) -> None:
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(self.size)
+        self._file.close()
+
+
+def read_spill_file(path: str) -> Tuple[object, object]:
+    """ Reads a spill file written by OneWireSpillFile
+
+        :returns: (timestamps, values)
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+    raw = raw[:len(raw) - len(raw) % 16]
+    if numpy is not None:
+        data = numpy.frombuffer(raw, dtype=numpy.float64)
+    else:
+        data = array('d', raw)
+    return data[0::2], data[1::2]
+
+
+class OneWireTimeSeries:
+    """ Samples of one register, kept in a preallocated ring buffer
+
+        Timestamps and values are interleaved in one buffer of doubles
+        (numpy array when numpy is available, array('d') otherwise), so
+        appending allocates nothing. The ring keeps the last 'capacity'
+        samples; samples older than 'max_age' seconds (relative to the
+        newest one) are also left out of the queries. With a spill file,
+        each time the ring wraps around the whole buffer (which is then in
+        chronological order) is copied to the file before being overwritten,
+        and history() returns the complete run.
+    """
+    def __init__(self, capacity: int = 65536, max_age: Optional[float] = None,
+                 spill_path: Optional[str] = None):
+        if capacity <= 0:
+            raise ValueError("Capacity must be positive")
+        self.capacity = capacity
+        self.max_age = max_age
+        self.count = 0  # samples appended since the creation
+        self._buffer = _new_buffer(2 * capacity)
+        self._head = 0  # index of the next sample
+        self.spill_path = spill_path
+        self._spill = OneWireSpillFile(spill_path) \
+            if spill_path is not None else None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp: float, value: float) -> None:
+        with self._lock:
+            i = 2 * self._head
+            self._buffer[i] = timestamp
+            self._buffer[i + 1] = value
+            self._head += 1
+            self.count += 1
+            if self._head == self.capacity:
+                self._head = 0
+                if self._spill is not None:
+                    self._spill.write(self._buffer)
+
+    def last(self) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            if self.count == 0:
+                return None
+            i = 2 * ((self._head - 1) % self.capacity)
+            return float(self._buffer[i]), float(self._buffer[i + 1])
+
+    def samples(self, since: Optional[float] = None) -> Tuple[object, object]:
+        """ Samples of the ring in chronological order, optionally only those
+            at or after 'since'
+
+            :returns: (timestamps, values), copies of the data
+        """
+        with self._lock:
+            return self._window(self._ordered(), since)
+
+    def history(self) -> Tuple[object, object]:
+        """ Every sample since the creation when spilling (the content of the
+            spill file once closed), else the whole ring
+        """
+        with self._lock:
+            if self._spill is not None:
+                data = _concat([self._spill.samples(),
+                                self._buffer[:2 * self._head]])
+            elif self.spill_path is not None:
+                return read_spill_file(self.spill_path)
+            else:
+                data = self._ordered()
+                if numpy is not None:
+                    data = data.copy()
+        return data[0::2], data[1::2]
+
+    def downsample(self, buckets: int, start: Optional[float] = None,
+                   end: Optional[float] = None):
+        """ Min/max/mean of the values over 'buckets' time intervals of equal
+            width between 'start' and 'end' (the retained range by default).
+            Empty intervals are left out.
+
+            :returns: (timestamps, minimums, maximums, means); timestamps are
+            the middle of each interval
+        """
+        timestamps, values = self.samples(start)
+        if len(timestamps) == 0 or buckets <= 0:
+            return tuple(_new_buffer(0) for _ in range(4))
+        if start is None:
+            start = timestamps[0]
+        if end is None:
+            end = timestamps[-1]
+        width = (end - start) / buckets
+        if width <= 0:
+            width = 1.0
+        if numpy is not None:
+            return self._downsampleNumpy(timestamps, values, buckets, start,
+                                         end, width)
+        return self._downsamplePython(timestamps, values, buckets, start, end,
+                                      width)
+
+    def close(self) -> None:
+        """ Writes the samples not spilled yet and closes the spill file """
+        with self._lock:
+            if self._spill is not None:
+                self._spill.write(self._buffer[:2 * self._head])
+                self._spill.close()
+                self._spill = None
+
+    def _ordered(self):
+        if self.count < self.capacity:
+            return self._buffer[:2 * self._head]
+        i = 2 * self._head
+        return _concat([self._buffer[i:], self._buffer[:i]])
+
+    def _window(self, data, since):
+        if self.max_age is not None and len(data) > 0:
+            oldest = data[-2] - self.max_age
+            since = oldest if since is None else max(since, oldest)
+        timestamps, values = data[0::2], data[1::2]
+        if since is None:
+            if numpy is not None:
+                return timestamps.copy(), values.copy()
+            return timestamps, values
+        if numpy is not None:
+            first = int(numpy.searchsorted(timestamps, since))
+            return timestamps[first:].copy(), values[first:].copy()
+        first = 0
+        while first < len(timestamps) and timestamps[first] < since:
+            first += 1
+        return timestamps[first:], values[first:]
+
+    @staticmethod
+    def _downsampleNumpy(timestamps, values, buckets, start, end, width):
+        keep = timestamps <= end
+        timestamps, values = timestamps[keep], values[keep]
+        index = numpy.minimum(((timestamps - start) // width).astype(int),
+                              buckets - 1)
+        used, first = numpy.unique(index, return_index=True)
+        counts = numpy.diff(numpy.append(first, len(values)))
+        mins = numpy.minimum.reduceat(values, first)
+        maxs = numpy.maximum.reduceat(values, first)
+        means = numpy.add.reduceat(values, first) / counts
+        return start + (used + 0.5) * width, mins, maxs, means
+
+    @staticmethod
+    def _downsamplePython(timestamps, values, buckets, start, end, width):
+        result = tuple(array('d') for _ in range(4))
+        current = None
+        for t, v in zip(timestamps, values):
+            if t > end:
+                break
+            b = min(int((t - start) // width), buckets - 1)
+            if b != current:
+                if current is not None:
+                    result[3].append(total / n)
+                current = b
+                result[0].append(start + (b + 0.5) * width)
+                result[1].append(v)
+                result[2].append(v)
+                total, n = 0.0, 0
+            if v < result[1][-1]:
+                result[1][-1] = v
+            if v > result[2][-1]:
+                result[2][-1] = v
+            total += v
+            n += 1
+        if current is not None:
+            result[3].append(total / n)
+        return result
+
+
+class OneWireTimeSeriesStore:
+    """ Time series of polled registers, keyed by (bus, device ID, register
+        name)
+
+        Series are created on their first sample with the capacity and
+        retention of the store; with a 'spill_directory', each series also
+        spills to a memory-mapped file of that directory. The scheduler can
+        feed the store directly:
+            OneWirePollingScheduler(ow, callback=partial(store.recordSample,
+                                                         bus="bus0"))
+        Failed samples (value None) are not recorded.
+    """
+    def __init__(self, capacity: int = 65536, max_age: Optional[float] = None,
+                 spill_directory: Optional[str] = None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.spill_directory = spill_directory
+        self._series = {}  # type: Dict[tuple, OneWireTimeSeries]
+        self._lock = threading.Lock()
+
+    def series(self, bus: str, device_id: int, register_name: str,
+               create: bool = True) -> Optional[OneWireTimeSeries]:
+        key = (bus, device_id, register_name)
+        s = self._series.get(key)
+        if s is None and create:
+            with self._lock:
+                s = self._series.get(key)
+                if s is None:
+                    s = OneWireTimeSeries(self.capacity, self.max_age,
+                                          self._spillPath(key))
+                    self._series[key] = s
+        return s
+
+    def keys(self) -> List[tuple]:
+        return list(self._series)
+
+    def append(self, bus: str, device_id: int, register_name: str,
+               timestamp: float, value: float) -> None:
+        self.series(bus, device_id, register_name).append(timestamp, value)
+
+    def recordSample(self, sample, bus: str = "") -> None:
+        """ Appends a OneWireSample of the polling scheduler """
+        if sample.value is not None:
+            self.series(bus, sample.device_id, sample.register_name).append(
+                sample.timestamp, sample.value)
+
+    def remove(self, bus: str, device_id: int, register_name: str) -> None:
+        with self._lock:
+            s = self._series.pop((bus, device_id, register_name), None)
+        if s is not None:
+            s.close()
+
+    def close(self) -> None:
+        """ Closes the spill files; the series stay readable """
+        for s in list(self._series.values()):
+            s.close()
+
+    def _spillPath(self, key: tuple) -> Optional[str]:
+        if self.spill_directory is None:
+            return None
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", "{}-{}-{}".format(*key))
+        return join(self.spill_directory, name + OW_SPILL_EXTENSION)
@@ -0,0 +1,107 @@
+OW_BITS_PER_BYTE = 10  # start bit, 8 data bits, stop bit
+OW_RDT_UNIT = 2e-6  # unit of the "Return delay time" register, in seconds
+OW_READ_REQUEST_SIZE = 8  # preamble, ID, length, instruction, address, size, checksum
+OW_STATUS_OVERHEAD = 6  # preamble, ID, length, status, checksum
+OW_MAX_RETURN_DELAY_TIME = 254
+
+
+def frame_time(size: int, baudrate: int) -> float:
+    """ Time needed to transmit 'size' bytes on the bus, in seconds """
+    return size * OW_BITS_PER_BYTE / baudrate
+
+
+def transaction_time(request_size: int, answer_size: int, baudrate: int,
+                     return_delay_time: int = 0,
+                     host_overhead: float = 0.0) -> float:
+    """ Bus time of a full transaction, in seconds
+
+        :param request_size: size of the instruction frame, preamble included
+        :param answer_size: size of the status frame, preamble included (0 if
+            no answer is expected)
+        :param return_delay_time: value of the device "Return delay time"
+            register
+        :param host_overhead: fixed latency added by the host and its adapter
+            (USB scheduling, driver latency timer...)
+    """
+    t = frame_time(request_size, baudrate) + host_overhead
+    if answer_size > 0:
+        t += frame_time(answer_size, baudrate)
+        t += return_delay_time * OW_RDT_UNIT
+    return t
+
+
+def read_transaction_time(length: int, baudrate: int,
+                          return_delay_time: int = 0,
+                          host_overhead: float = 0.0) -> float:
+    """ Bus time of a READ of 'length' bytes, in seconds """
+    return transaction_time(OW_READ_REQUEST_SIZE, OW_STATUS_OVERHEAD + length,
+                            baudrate, return_delay_time, host_overhead)
+
+
+class OneWireTimeoutModel:
+    """ Per-device transaction timeout
+
+        The timeout of a transaction is its theoretical bus time (baudrate,
+        frame sizes and "Return delay time" of the device, assumed to be the
+        maximum until known) plus a margin over the worst extra latency
+        observed for this device (host scheduling, USB adapter buffering...).
+        Until 'min_samples' answers have been observed, the configured
+        ceiling is used. The observed peak slowly decays so that timeouts
+        tighten automatically, and is doubled after each timeout. The
+        'floor' covers the latency spikes (OS scheduling, USB polling) rarer
+        than what a few samples show; below a few milliseconds clean buses
+        get spurious timeouts.
+    """
+    def __init__(self, margin: float = 2.0, floor: float = 0.005,
+                 min_samples: int = 4, decay: float = 0.99):
+        self.margin = margin
+        self.floor = floor
+        self.min_samples = min_samples
+        self.decay = decay
+        self.return_delay_times = {}
+        self._samples = {}
+        self._peak_latency = {}
+
+    def setReturnDelayTime(self, device_id: int, return_delay_time: int):
+        if self.return_delay_times.get(device_id) != return_delay_time:
+            # Past observations were measured against another expected time
+            self.reset(device_id)
+            self.return_delay_times[device_id] = return_delay_time
+
+    def reset(self, device_id: int = None):
+        if device_id is None:
+            self.return_delay_times.clear()
+            self._samples.clear()
+            self._peak_latency.clear()
+        else:
+            self.return_delay_times.pop(device_id, None)
+            self._samples.pop(device_id, None)
+            self._peak_latency.pop(device_id, None)
+
+    def expectedTime(self, device_id: int, request_size: int,
+                     answer_size: int, baudrate: int) -> float:
+        rdt = self.return_delay_times.get(device_id, OW_MAX_RETURN_DELAY_TIME)
+        return transaction_time(request_size, answer_size, baudrate, rdt)
+
+    def timeout(self, device_id: int, request_size: int, answer_size: int,
+                baudrate: int, ceiling: float) -> float:
+        if self._samples.get(device_id, 0) < self.min_samples:
+            return ceiling
+        expected = self.expectedTime(device_id, request_size, answer_size,
+                                     baudrate)
+        t = expected + self.margin * self._peak_latency[device_id] + self.floor
+        return min(ceiling, t)
+
+    def observe(self, device_id: int, request_size: int, answer_size: int,
+                baudrate: int, elapsed: float):
+        expected = self.expectedTime(device_id, request_size, answer_size,
+                                     baudrate)
+        extra = max(0.0, elapsed - expected)
+        peak = self._peak_latency.get(device_id, 0.0) * self.decay
+        self._peak_latency[device_id] = max(extra, peak)
+        self._samples[device_id] = self._samples.get(device_id, 0) + 1
+
+    def timedOut(self, device_id: int):
+        if device_id in self._peak_latency:
+            self._peak_latency[device_id] = \
+                max(2 * self._peak_latency[device_id], self.floor)
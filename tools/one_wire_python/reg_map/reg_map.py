@@ -1,6 +1,10 @@
-from os.path import dirname, abspath, join, isfile, basename
+from os.path import dirname, abspath, join, isfile, basename, getmtime
 from os import listdir
 from importlib.util import spec_from_file_location, module_from_spec
+from collections import namedtuple, OrderedDict
+import ast
+import struct
+import threading
 
 """
 Structure typing:
@@ -10,8 +14,22 @@ OneWireRegisterEntry: (int, int, str, bool, int, int, str)
 Structure meaning:
 OneWireRegisterMap: (name, [EEPROM_register, ...], [RAM_register, ...])
 OneWireRegisterEntry: (address, size, name, writable, min, max, docstring)
+
+A register map file may also define OneWireModelNumber (int or tuple of int),
+the value(s) of the "Model number" register (address 0) of the devices it
+describes, used to select the map automatically.
+
+compile_register_map turns a OneWireRegisterMap into a
+OneWireCompiledRegisterMap, which can be used wherever the tuple is expected
+(map[0], map[1] and map[2] still give the name and the two areas, whose
+entries are OneWireRegister, themselves usable as OneWireRegisterEntry).
 """
 
+# Little-endian struct format of an unsigned register, by size
+OW_REGISTER_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+OW_REGISTER_STRUCTS = {size: struct.Struct("<" + f)
+                       for size, f in OW_REGISTER_FORMATS.items()}
+
 def register_map_structure_check(register_map):
     assert isinstance(register_map, tuple)
     assert len(register_map) == 3
@@ -39,23 +57,356 @@ def register_map_structure_check(register_map):
 
 
 def get_register_map_list():
-    this_file = abspath(__file__)
-    reg_dir = dirname(this_file)
-    other_files = []
-    for f in listdir(reg_dir):
-        file = join(reg_dir, f)
-        if isfile(file) and file != this_file and file.lower().endswith('.py'):
-            other_files.append(file)
-    reg_map_list = []
-    for f in other_files:
-        # noinspection PyBroadException
+    """ Loads every register map of the default catalog """
+    catalog = default_catalog()
+    maps = [catalog.get(name) for name in catalog.names()]
+    return [m for m in maps if m is not None]
+
+
+def get_register_area_span(register_area):
+    """ Returns (start_address, length) of the memory covered by an area """
+    start = min(e[0] for e in register_area)
+    end = max(e[0] + e[1] for e in register_area)
+    return start, end - start
+
+
+def decode_register_area(register_area, start_address, data):
+    """ Splits a raw memory block into the values of each register
+
+        :returns:
+            A list of int, one per entry of register_area (same order)
+    """
+    if isinstance(register_area, OneWireRegisterArea) and \
+            register_area.struct is not None and \
+            start_address == register_area.start and \
+            len(data) == register_area.length:
+        return list(register_area.struct.unpack(data))
+    values = []
+    for e in register_area:
+        offset = e[0] - start_address
+        if offset < 0 or offset + e[1] > len(data):
+            raise IndexError("Register '" + e[2] + "' is outside the block")
+        values.append(int.from_bytes(data[offset:offset + e[1]], 'little'))
+    return values
+
+
+def read_register_area(ow_interface, device_id, register_area):
+    """ Reads a whole register area with a single READ transaction
+
+        :returns:
+            (device_status, [value, ...]) with one value per entry of
+            register_area
+    """
+    start, length = get_register_area_span(register_area)
+    err, data = ow_interface.readBlock(device_id, start, length)
+    return err, decode_register_area(register_area, start, data)
+
+
+def encode_register_values(register_entry, values):
+    """ Validates a batch of values against the bounds of a register, then
+        encodes each of them as little-endian bytes
+
+        :raises ValueError:
+            If any value of the batch is out of the register range
+    """
+    if len(values) == 0:
+        return []
+    if min(values) < register_entry[4] or max(values) > register_entry[5]:
+        raise ValueError("Value out of range for register '" +
+                         register_entry[2] + "'")
+    size = register_entry[1]
+    return [int(v).to_bytes(size, 'little') for v in values]
+
+
+def sync_write_register(ow_interface, id_list, register_entry, values):
+    """ Writes one value per device to the same register with a single
+        SYNC_WRITE packet
+    """
+    if not register_entry[3]:
+        raise ValueError("Register '" + register_entry[2] + "' is read-only")
+    ow_interface.syncWrite(id_list, register_entry[0],
+                           encode_register_values(register_entry, values))
+
+
+_OneWireRegisterEntry = namedtuple("OneWireRegisterEntry", [
+    "address", "size", "name", "writable", "min", "max", "doc"])
+
+
+class OneWireRegister(_OneWireRegisterEntry):
+    """ Register record of a compiled map, still a OneWireRegisterEntry """
+    __slots__ = ()
+
+    @property
+    def struct(self):
+        """ struct.Struct of the register, None for unusual sizes """
+        return OW_REGISTER_STRUCTS.get(self.size)
+
+    def validate(self, value: int) -> None:
+        if not self.writable:
+            raise ValueError("Register '" + self.name + "' is read-only")
+        if not self.min <= value <= self.max:
+            raise ValueError("Value out of range for register '" +
+                             self.name + "'")
+
+    def encode(self, value: int) -> bytes:
+        """ Validates then encodes a value to write """
+        self.validate(value)
+        return int(value).to_bytes(self.size, 'little')
+
+    def decode(self, data, offset: int = 0) -> int:
+        s = OW_REGISTER_STRUCTS.get(self.size)
+        if s is not None:
+            return s.unpack_from(data, offset)[0]
+        return int.from_bytes(data[offset:offset + self.size], 'little')
+
+
+class OneWireRegisterArea(list):
+    """ Registers of one area (EEPROM or RAM), sorted by address
+
+        'struct' decodes the whole span of the area at once (gaps between
+        registers are skipped); it is None when a register has an unusual
+        size or when registers overlap.
+    """
+    __slots__ = ("start", "length", "struct")
+
+    def __init__(self, registers):
+        super().__init__(sorted(registers, key=lambda r: r.address))
+        self.struct = None
+        if len(self) == 0:
+            self.start, self.length = 0, 0
+            return
+        self.start, self.length = get_register_area_span(self)
+        fmt = "<"
+        position = self.start
+        for r in self:
+            if r.address < position or r.size not in OW_REGISTER_FORMATS:
+                return
+            if r.address > position:
+                fmt += str(r.address - position) + "x"
+            fmt += OW_REGISTER_FORMATS[r.size]
+            position = r.address + r.size
+        self.struct = struct.Struct(fmt)
+
+    def decode(self, data) -> OrderedDict:
+        """ Decodes a block covering the whole area into {name: value} """
+        return OrderedDict(zip((r.name for r in self),
+                               decode_register_area(self, self.start, data)))
+
+    def encode(self, values: dict) -> bytes:
+        """ Encodes {name: value} (every register of the area) into a block,
+            validating the writable registers
+        """
+        if self.struct is not None:
+            for r in self:
+                if r.writable:
+                    r.validate(values[r.name])
+            return self.struct.pack(*(values[r.name] for r in self))
+        data = bytearray(self.length)
+        for r in self:
+            offset = r.address - self.start
+            data[offset:offset + r.size] = \
+                int(values[r.name]).to_bytes(r.size, 'little')
+            if r.writable:
+                r.validate(values[r.name])
+        return bytes(data)
+
+
+class OneWireCompiledRegisterMap:
+    """ Register map with O(1) lookup by name and by address, and
+        table-driven decoding of raw memory blocks
+    """
+    __slots__ = ("name", "eeprom", "ram", "registers", "by_name",
+                 "by_address", "source")
+
+    def __init__(self, register_map, source=None):
+        self.name = register_map[0]
+        self.eeprom = OneWireRegisterArea(
+            OneWireRegister(*e) for e in register_map[1])
+        self.ram = OneWireRegisterArea(
+            OneWireRegister(*e) for e in register_map[2])
+        self.registers = list(self.eeprom) + list(self.ram)
+        self.by_name = {r.name: r for r in self.registers}
+        self.by_address = {r.address: r for r in self.registers}
+        self.source = source  # register map file, if any
+
+    # OneWireRegisterMap compatibility: (name, EEPROM area, RAM area)
+    def __getitem__(self, index):
+        return (self.name, self.eeprom, self.ram)[index]
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter((self.name, self.eeprom, self.ram))
+
+    def register(self, name: str) -> OneWireRegister:
+        return self.by_name[name]
+
+    def at(self, address: int) -> OneWireRegister:
+        return self.by_address[address]
+
+    def areas(self):
+        return [a for a in (self.eeprom, self.ram) if len(a) > 0]
+
+    def decodeBlock(self, start_address: int, data) -> OrderedDict:
+        """ Decodes every register fully contained in a raw memory block
+
+            :returns:
+                {name: value} in address order
+        """
+        for area in (self.eeprom, self.ram):
+            if area.struct is not None and start_address == area.start \
+                    and len(data) == area.length:
+                return area.decode(data)
+        end = start_address + len(data)
+        values = OrderedDict()
+        for r in self.registers:
+            if r.address >= start_address and r.address + r.size <= end:
+                values[r.name] = r.decode(data, r.address - start_address)
+        return values
+
+
+def compile_register_map(register_map, source=None) -> OneWireCompiledRegisterMap:
+    if isinstance(register_map, OneWireCompiledRegisterMap):
+        return register_map
+    return OneWireCompiledRegisterMap(register_map, source)
+
+
+"""
+OneWireCatalogEntry: (name, model_numbers, path, mtime)
+"""
+OneWireCatalogEntry = namedtuple("OneWireCatalogEntry",
+                                 ["name", "model_numbers", "path", "mtime"])
+
+
+class OneWireRegisterMapCatalog:
+    """ Index of the register map files of a directory
+
+        refresh() only parses the files (with ast, nothing is executed) to
+        get the map names and model numbers, and only the files whose mtime
+        changed since the last refresh. A map is executed, checked and
+        compiled on its first get(), then served from the cache until its
+        file changes. Files which cannot be indexed or loaded are recorded
+        in 'errors' (path -> message) instead of being silently skipped.
+    """
+    def __init__(self, directory: str = None):
+        if directory is None:
+            directory = dirname(abspath(__file__))
+        self.directory = directory
+        self.errors = {}
+        self._entries = OrderedDict()  # name -> OneWireCatalogEntry
+        self._by_path = {}  # path -> OneWireCatalogEntry
+        self._maps = {}  # path -> (mtime, OneWireCompiledRegisterMap)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> None:
+        with self._lock:
+            this_file = abspath(__file__)
+            by_path = {}
+            for f in sorted(listdir(self.directory)):
+                file = join(self.directory, f)
+                if not isfile(file) or abspath(file) == this_file or \
+                        not file.lower().endswith('.py'):
+                    continue
+                mtime = getmtime(file)
+                entry = self._by_path.get(file)
+                if entry is None or entry.mtime != mtime:
+                    entry = self._index(file, mtime)
+                if entry is not None:
+                    by_path[file] = entry
+            self._by_path = by_path
+            self._entries = OrderedDict(
+                (e.name, e) for e in sorted(by_path.values(),
+                                            key=lambda x: x.name))
+
+    def names(self) -> list:
+        return list(self._entries.keys())
+
+    def entries(self) -> list:
+        return list(self._entries.values())
+
+    def get(self, name: str):
+        """ :returns: the compiled map, None if it cannot be loaded """
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        return self._load(entry)
+
+    def byModelNumber(self, model_number: int):
+        for entry in self._entries.values():
+            if model_number in entry.model_numbers:
+                return self._load(entry)
+        return None
+
+    def detect(self, ow_interface, device_id: int):
+        """ Reads the "Model number" register (U16 at 0) of a device and
+            returns the matching map, or None
+        """
+        _, model_number = ow_interface.readU16(device_id, 0)
+        return self.byModelNumber(model_number)
+
+    def _index(self, path: str, mtime: float):
         try:
-            spec = spec_from_file_location(basename(f), f)
-            reg_module = module_from_spec(spec)
-            spec.loader.exec_module(reg_module)
-            reg_map = reg_module.OneWireRegisterMap
-            register_map_structure_check(reg_map)
-            reg_map_list.append(reg_map)
-        except Exception:
-            pass
-    return reg_map_list
+            with open(path, 'r') as file:
+                tree = ast.parse(file.read(), path)
+            name = None
+            model_numbers = ()
+            for node in tree.body:
+                if not isinstance(node, ast.Assign) or \
+                        len(node.targets) != 1 or \
+                        not isinstance(node.targets[0], ast.Name):
+                    continue
+                target = node.targets[0].id
+                if target == "OneWireRegisterMap" and \
+                        isinstance(node.value, ast.Tuple):
+                    name = ast.literal_eval(node.value.elts[0])
+                elif target == "OneWireModelNumber":
+                    value = ast.literal_eval(node.value)
+                    model_numbers = tuple(value) \
+                        if isinstance(value, (tuple, list)) else (value,)
+            if not isinstance(name, str):
+                raise ValueError("No OneWireRegisterMap name found")
+        except (OSError, SyntaxError, ValueError, IndexError) as e:
+            self.errors[path] = str(e)
+            return None
+        self.errors.pop(path, None)
+        return OneWireCatalogEntry(name, model_numbers, path, mtime)
+
+    def _load(self, entry: OneWireCatalogEntry):
+        with self._lock:
+            try:
+                mtime = getmtime(entry.path)
+            except OSError as e:
+                self.errors[entry.path] = str(e)
+                return None
+            cached = self._maps.get(entry.path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            # noinspection PyBroadException
+            try:
+                spec = spec_from_file_location(basename(entry.path),
+                                               entry.path)
+                reg_module = module_from_spec(spec)
+                spec.loader.exec_module(reg_module)
+                reg_map = reg_module.OneWireRegisterMap
+                register_map_structure_check(reg_map)
+            except Exception as e:
+                self.errors[entry.path] = str(e)
+                return None
+            compiled = compile_register_map(reg_map, entry.path)
+            self._maps[entry.path] = (mtime, compiled)
+            self.errors.pop(entry.path, None)
+            return compiled
+
+
+_default_catalog = None
+
+
+def default_catalog() -> OneWireRegisterMapCatalog:
+    """ Catalog of the maps shipped next to this file, created on first use
+    """
+    global _default_catalog
+    if _default_catalog is None:
+        _default_catalog = OneWireRegisterMapCatalog()
+    return _default_catalog
@@ -1,3 +1,5 @@
+OneWireModelNumber = 12
+
 OneWireRegisterMap = (
     "AX12",
 [  # EEPROM Area
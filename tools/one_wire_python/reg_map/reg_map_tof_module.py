@@ -1,3 +1,5 @@
+OneWireModelNumber = 5301
+
 OneWireRegisterMap = (
     "ToF Module",
 [  # EEPROM Area
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import threading
+import unittest
+
+from one_wire_async import AsyncOneWireMasterInterface
+from one_wire_packet import OneWirePacket
+from one_wire_parser import OneWireFrameParser
+from one_wire_python import OneWireComError
+
+try:
+    import tty
+except ImportError:
+    tty = None
+
+
+@unittest.skipIf(tty is None or not hasattr(os, "openpty"), "needs a pty")
+class TestAsyncMaster(unittest.TestCase):
+    """ The device at the other end of a pty answers a PING sent to ID n
+        with the ID 'answer_ids[n]'
+    """
+    answer_ids = {1: 1, 2: 7}
+
+    def setUp(self):
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.master_fd)
+        tty.setraw(self.slave_fd)
+        threading.Thread(target=self._device, daemon=True).start()
+
+    def tearDown(self):
+        os.close(self.slave_fd)
+        os.close(self.master_fd)
+
+    def _device(self):
+        parser = OneWireFrameParser()
+        while True:
+            try:
+                data = os.read(self.master_fd, 64)
+            except OSError:
+                return
+            for frame in parser.feed(data):
+                body = bytes([self.answer_ids[frame.id], 2, 0])
+                os.write(self.master_fd, b"\xff\xff" + body +
+                         bytes([OneWirePacket.checksum(body)]))
+
+    def test_answer_from_another_id(self):
+        async def run():
+            ow = AsyncOneWireMasterInterface(os.ttyname(self.slave_fd))
+            await ow.open()
+            try:
+                self.assertEqual(await ow.ping(1), 0)
+                with self.assertRaises(OneWireComError):
+                    await ow.ping(2)
+                self.assertEqual(
+                    ow.metrics.snapshot()[2]["PING"]["errors"],
+                    {"com_error": 1})
+            finally:
+                ow.close()
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from one_wire_provisioning import OneWireProvisioner
+from one_wire_simulator import (VirtualOneWireDevice, create_virtual_interface,
+                                OW_BROADCAST_ID)
+from reg_map.reg_map import default_catalog
+
+
+class TestProvisioning(unittest.TestCase):
+    def setUp(self):
+        self.register_map = default_catalog().get("ToF Module")
+        self.devices = [VirtualOneWireDevice(self.register_map, i,
+                                             model_number=5301)
+                        for i in (1, 2, 3)]
+        self.ow = create_virtual_interface(self.devices, timeout=0.05)
+        self.sent_to = []
+        write = self.ow.serial.write
+
+        def spy(data):
+            self.sent_to.append(data[2])
+            return write(data)
+        self.ow.serial.write = spy
+
+    def tearDown(self):
+        self.ow.close()
+
+    def provisioner(self, preset):
+        return OneWireProvisioner(self.ow, self.register_map, preset,
+                                  apply_baudrate=False)
+
+    def test_shared_run_is_sync_written(self):
+        address = self.register_map.by_name["Minimum range"].address
+        reports = self.provisioner({address: (2, 123)}).run([1, 2, 3])
+        self.assertEqual([r.status for r in reports], ["ok"] * 3)
+        self.assertEqual([d.get("Minimum range") for d in self.devices],
+                         [123] * 3)
+        self.assertIn(OW_BROADCAST_ID, self.sent_to)
+
+    def test_chained_renames(self):
+        reports = self.provisioner({}).run([1, 2], new_ids={1: 2, 2: 4})
+        self.assertEqual([r.status for r in reports], ["ok", "ok"])
+        self.assertEqual([d.id for d in self.devices], [2, 4, 3])
+
+    def test_rename_blocked_by_a_kept_id(self):
+        reports = self.provisioner({}).run([1, 2, 3], new_ids={1: 2, 2: 3})
+        self.assertEqual([r.status for r in reports],
+                         ["id conflict", "id conflict", "unchanged"])
+        self.assertEqual([d.id for d in self.devices], [1, 2, 3])
+
+    def test_cycle_of_renames(self):
+        reports = self.provisioner({}).run([1, 2, 3],
+                                           new_ids={1: 2, 2: 3, 3: 1})
+        self.assertEqual([r.status for r in reports], ["ok"] * 3)
+        self.assertEqual([d.id for d in self.devices], [2, 3, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
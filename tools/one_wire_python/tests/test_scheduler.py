@@ -0,0 +1,42 @@
+import time
+import unittest
+
+from one_wire_scheduler import OneWirePollingScheduler
+from one_wire_simulator import VirtualOneWireDevice, create_virtual_interface
+from one_wire_timing import read_transaction_time
+from reg_map.reg_map import default_catalog
+
+
+class TestPollingScheduler(unittest.TestCase):
+    def setUp(self):
+        self.register_map = default_catalog().get("ToF Module")
+        self.device = VirtualOneWireDevice(self.register_map, 1,
+                                           return_delay_time=100)
+        self.ow = create_virtual_interface([self.device])
+        self.entry = self.register_map.by_name["Model number"]
+        self.scheduler = OneWirePollingScheduler(self.ow)
+        self.scheduler.subscribe(1, self.entry, 100)
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.ow.close()
+
+    def test_plan_uses_device_return_delay_time(self):
+        self.scheduler.start()
+        self.scheduler.stop()
+        group, = self.scheduler.plan().groups
+        self.assertEqual(group.cost, read_transaction_time(
+            2, self.ow.serial.baudrate, 100, self.scheduler.host_overhead))
+
+    def test_stops_running_after_io_error(self):
+        self.scheduler.start()
+        self.ow.serial.close()
+        deadline = time.monotonic() + 1.0
+        while self.scheduler.isRunning() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.scheduler.isRunning())
+        self.assertIsInstance(self.scheduler.io_error, IOError)
+
+
+if __name__ == "__main__":
+    unittest.main()
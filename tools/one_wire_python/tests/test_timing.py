@@ -0,0 +1,36 @@
+import unittest
+
+from one_wire_python import OneWireTimeout
+from one_wire_simulator import VirtualOneWireDevice, create_virtual_interface
+from one_wire_timing import OneWireTimeoutModel
+from reg_map.reg_map import default_catalog
+
+
+class TestTimeoutModel(unittest.TestCase):
+    def test_floor_after_learning(self):
+        model = OneWireTimeoutModel()
+        model.setReturnDelayTime(1, 0)
+        for _ in range(model.min_samples):
+            model.observe(1, 8, 36, 1000000, 0.0)
+        expected = model.expectedTime(1, 8, 36, 1000000)
+        self.assertAlmostEqual(model.timeout(1, 8, 36, 1000000, 0.1),
+                               expected + model.floor)
+        self.assertGreaterEqual(model.floor, 0.002)
+
+    def test_no_timeout_on_clean_bus(self):
+        register_map = default_catalog().get("ToF Module")
+        for baudrate in (115200, 1000000):
+            device = VirtualOneWireDevice(register_map, 1, baudrate=baudrate)
+            ow = create_virtual_interface([device], baudrate=baudrate)
+            timeouts = 0
+            for _ in range(300):
+                try:
+                    ow.readBlock(1, 0, 30)
+                except OneWireTimeout:
+                    timeouts += 1
+            ow.close()
+            self.assertEqual(timeouts, 0, "at {} bauds".format(baudrate))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+from PyQt5.QtCore import Qt, QTimer, QPointF
+from PyQt5.QtGui import QPainter, QPen, QColor, QPolygonF
+from PyQt5.QtWidgets import (QWidget, QPushButton, QLabel, QComboBox,
+                             QHBoxLayout, QVBoxLayout)
+from one_wire_timeseries import OneWireTimeSeriesStore
+
+OW_PLOT_FRAME_PERIOD = 40  # ms, repaint budget (25 frames per second)
+OW_PLOT_WINDOWS = [2, 5, 10, 30, 60]  # seconds
+OW_PLOT_RATES = [10, 20, 50, 100, 200]  # Hz
+OW_PLOT_COLORS = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd",
+                  "#8c564b", "#e377c2", "#17becf"]
+
+
+class WidgetLivePlotCanvas(QWidget):
+    """ Draws the last 'window' seconds of some series of a store
+
+        The canvas is repainted by a timer every OW_PLOT_FRAME_PERIOD ms, and
+        only when a series got new samples; the samples are never drawn
+        one by one: each series is downsampled to one bucket per pixel
+        column, drawn as its min/max envelope and its mean.
+    """
+    def __init__(self, master, store: OneWireTimeSeriesStore):
+        super().__init__(master)
+        # Members
+        self.store = store
+        self.window = 10.0
+        self.channels = []  # [(series key, label, QColor), ...]
+        self._counts = None
+        self.setMinimumSize(400, 200)
+
+        # Repaint timer
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._tick)
+        self._timer.start(OW_PLOT_FRAME_PERIOD)
+
+    def add_channel(self, key, label):
+        color = QColor(OW_PLOT_COLORS[len(self.channels) % len(OW_PLOT_COLORS)])
+        self.channels.append((key, label, color))
+        self.update()
+
+    def clear(self):
+        self.channels = []
+        self.update()
+
+    def set_window(self, seconds):
+        self.window = float(seconds)
+        self.update()
+
+    def _tick(self):
+        if not self.isVisible():
+            return
+        counts = []
+        for key, _, _ in self.channels:
+            s = self.store.series(*key, create=False)
+            counts.append(0 if s is None else s.count)
+        if counts != self._counts:
+            self._counts = counts
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        width, height = self.width(), self.height()
+        series = []
+        end = None
+        for key, label, color in self.channels:
+            s = self.store.series(*key, create=False)
+            last = None if s is None else s.last()
+            series.append((s, label, color, last))
+            if last is not None and (end is None or last[0] > end):
+                end = last[0]
+        curves = []
+        if end is not None:
+            start = end - self.window
+            for s, _, color, _ in series:
+                if s is not None:
+                    curves.append((color, s.downsample(width, start, end)))
+        y_min = min((min(c[1][1]) for c in curves if len(c[1][0]) > 0),
+                    default=0.0)
+        y_max = max((max(c[1][2]) for c in curves if len(c[1][0]) > 0),
+                    default=1.0)
+        if y_max <= y_min:
+            y_min, y_max = y_min - 1, y_max + 1
+        margin = 14
+        scale = (height - 2 * margin) / (y_max - y_min)
+
+        def y_pixel(v):
+            return height - margin - (v - y_min) * scale
+
+        for color, (t, mins, maxs, means) in curves:
+            x = [(ti - start) / self.window * width for ti in t]
+            envelope = QColor(color)
+            envelope.setAlpha(80)
+            painter.setPen(QPen(envelope, 1))
+            for xi, lo, hi in zip(x, mins, maxs):
+                if hi > lo:
+                    painter.drawLine(QPointF(xi, y_pixel(lo)),
+                                     QPointF(xi, y_pixel(hi)))
+            painter.setPen(QPen(color, 1))
+            painter.drawPolyline(QPolygonF(
+                [QPointF(xi, y_pixel(m)) for xi, m in zip(x, means)]))
+
+        # Scale and legend
+        painter.setPen(Qt.darkGray)
+        painter.drawText(2, margin - 2, "{:g}".format(y_max))
+        painter.drawText(2, height - 2, "{:g}".format(y_min))
+        y = margin - 2
+        for _, label, color, last in series:
+            painter.setPen(color)
+            text = label if last is None else \
+                "{} = {:g}".format(label, last[1])
+            metrics = painter.fontMetrics()
+            painter.drawText(width - metrics.horizontalAdvance(text) - 4, y,
+                             text)
+            y += metrics.height()
+
+
+class WidgetLivePlot(QWidget):
+    """ Live plot of polled registers
+
+        Registers are added for the current device ID and polled at the
+        selected rate; cbStart(subscriptions) is called with the list of
+        (device_id, register_entry, rate) to poll and returns False when
+        polling cannot start, cbStop() stops it. Why polling could not start
+        or has stopped is shown with set_status().
+    """
+    def __init__(self, master, store, cbGetDeviceId, cbStart, cbStop):
+        super().__init__(master)
+        # Members
+        self.register_map = None
+        self.subscriptions = []  # [(device_id, register_entry, rate), ...]
+        self.running = False
+
+        # Callbacks
+        self.cb_get_device_id = cbGetDeviceId
+        self.cb_start = cbStart
+        self.cb_stop = cbStop
+
+        # Widgets
+        title = QLabel("Live plot", self)
+        self.register_combobox = QComboBox(self)
+        self.rate_combobox = QComboBox(self)
+        self.rate_combobox.addItems([str(r) + " Hz" for r in OW_PLOT_RATES])
+        self.rate_combobox.setCurrentIndex(OW_PLOT_RATES.index(100))
+        self.window_combobox = QComboBox(self)
+        self.window_combobox.addItems([str(w) + " s" for w in OW_PLOT_WINDOWS])
+        self.window_combobox.setCurrentIndex(OW_PLOT_WINDOWS.index(10))
+        self.window_combobox.currentIndexChanged.connect(self._window_changed)
+        b_add = QPushButton("Add", self)
+        b_add.clicked.connect(self._add)
+        b_clear = QPushButton("Clear", self)
+        b_clear.clicked.connect(self._clear)
+        self.b_start = QPushButton("Start", self)
+        self.b_start.clicked.connect(self._start_stop)
+        self.canvas = WidgetLivePlotCanvas(self, store)
+        self.label_status = QLabel(self)
+        self.label_status.setStyleSheet("QLabel { color: #d62728; }")
+        self.label_status.setWordWrap(True)
+        self.label_status.hide()
+
+        # Layout
+        title_grid = QHBoxLayout()
+        title_grid.addWidget(title)
+        title_grid.addWidget(self.register_combobox)
+        title_grid.addWidget(self.rate_combobox)
+        title_grid.addWidget(b_add)
+        title_grid.addWidget(b_clear)
+        title_grid.addWidget(self.window_combobox)
+        title_grid.addWidget(self.b_start)
+        title_grid.setStretch(0, 1)
+        title_grid.setContentsMargins(10, 5, 0, 0)
+        v_grid = QVBoxLayout()
+        v_grid.addLayout(title_grid)
+        v_grid.addWidget(self.label_status)
+        v_grid.addWidget(self.canvas)
+        v_grid.setStretch(2, 1)
+        v_grid.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(v_grid)
+
+    def set_register_map(self, register_map):
+        self.register_map = register_map
+        self.register_combobox.clear()
+        if register_map is not None:
+            self.register_combobox.addItems(
+                [r.name for r in register_map.registers])
+
+    def set_enabled(self, e):
+        self.b_start.setEnabled(e)
+        if not e:
+            self.stop()
+
+    def stop(self):
+        if self.running:
+            self.cb_stop()
+        self._set_running(False)
+
+    def restart(self):
+        """ Starts polling again with the current subscriptions if it was
+            running (the owner stopped it for a while)
+        """
+        if self.running:
+            self._set_running(self.cb_start(self.subscriptions))
+
+    def set_status(self, text):
+        """ Shows a message above the plot, hidden when 'text' is empty """
+        self.label_status.setText(text)
+        self.label_status.setVisible(len(text) > 0)
+
+    def _add(self):
+        index = self.register_combobox.currentIndex()
+        if self.register_map is None or index < 0:
+            return
+        entry = self.register_map.registers[index]
+        device_id = self.cb_get_device_id()
+        if any(s[0] == device_id and s[1][0] == entry[0]
+               for s in self.subscriptions):
+            return
+        rate = OW_PLOT_RATES[self.rate_combobox.currentIndex()]
+        self.subscriptions.append((device_id, entry, rate))
+        self.canvas.add_channel(("", device_id, entry[2]),
+                                "{}: {}".format(device_id, entry[2]))
+        if self.running:
+            self._set_running(self.cb_start(self.subscriptions))
+
+    def _clear(self):
+        self.stop()
+        for key, _, _ in self.canvas.channels:
+            self.canvas.store.remove(*key)
+        self.subscriptions = []
+        self.canvas.clear()
+
+    def _start_stop(self):
+        if self.running:
+            self.stop()
+        elif len(self.subscriptions) > 0:
+            self._set_running(self.cb_start(self.subscriptions))
+
+    def _set_running(self, running):
+        self.running = running
+        self.b_start.setText("Stop" if running else "Start")
+
+    def _window_changed(self, index):
+        self.canvas.set_window(OW_PLOT_WINDOWS[index])
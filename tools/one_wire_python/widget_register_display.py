@@ -1,29 +1,40 @@
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import (QWidget, QPushButton, QLabel, QVBoxLayout,
                              QScrollArea, QHBoxLayout, QComboBox, QFileDialog)
 from widget_register_entry import WidgetRegisterEntryList
-from reg_map.reg_map import get_register_map_list
+from reg_map.reg_map import default_catalog
+from one_wire_preset import (OneWirePresetImage, OneWirePresetError,
+                             parse_json_preset, OW_PRESET_MAGIC)
 from os.path import dirname, join
 import json
 
+OW_PRESET_FILTERS = "OW EEPROM (*.ow);;OW EEPROM image (*.owb)"
+
 
 class WidgetRegisterDisplay(QWidget):
-    def __init__(self, master, cb_read, cb_write):
+    register_map_changed = pyqtSignal(object)  # compiled register map
+
+    def __init__(self, master, cb_read, cb_write, cb_read_block=None):
         super().__init__(master)
-        self.reg_map_list = get_register_map_list()
+        self.catalog = default_catalog()
+        self.catalog.refresh()
+        self.reg_map_names = self.catalog.names()
         self.current_preset_dir = join(dirname(__file__), "presets")
 
         # Widgets
         title = QLabel("Registers editor", self)
-        self.register_entries = WidgetRegisterEntryList(self, cb_read, cb_write)
-        reg_map_combobox = QComboBox(self)
-        reg_map_combobox.addItems([r[0] for r in self.reg_map_list])
-        reg_map_combobox.currentIndexChanged.connect(self._update_reg_list)
+        self.register_entries = WidgetRegisterEntryList(self, cb_read, cb_write,
+                                                        cb_read_block)
+        self.reg_map_combobox = QComboBox(self)
+        self.reg_map_combobox.addItems(self.reg_map_names)
+        self.reg_map_combobox.currentIndexChanged.connect(self._update_reg_list)
         self.b_read_all = QPushButton("Read all", self)
         self.b_save_eeprom = QPushButton("Save EEPROM", self)
         self.b_save_eeprom.clicked.connect(self._save_eeprom)
         self.b_load_eeprom = QPushButton("Load EEPROM", self)
         self.b_load_eeprom.clicked.connect(self._load_eeprom)
-        self.b_read_all.clicked.connect(self.register_entries.read_all)
+        self.b_read_all.clicked.connect(self._read_all)
+        self.register_entries.busy_changed.connect(self._read_all_busy)
         self.scroll_area = QScrollArea(self)
         self.scroll_area.setWidget(self.register_entries)
         self.scroll_area.setWidgetResizable(True)
@@ -32,7 +43,7 @@ class WidgetRegisterDisplay(QWidget):
         # Layout
         title_grid = QHBoxLayout()
         title_grid.addWidget(title)
-        title_grid.addWidget(reg_map_combobox)
+        title_grid.addWidget(self.reg_map_combobox)
         title_grid.addWidget(self.b_read_all)
         title_grid.addWidget(self.b_save_eeprom)
         title_grid.addWidget(self.b_load_eeprom)
@@ -46,7 +57,7 @@ class WidgetRegisterDisplay(QWidget):
         self.setLayout(v_grid)
 
         # Init
-        self._update_reg_list(reg_map_combobox.currentIndex())
+        self._update_reg_list(self.reg_map_combobox.currentIndex())
 
     def set_enabled(self, e):
         self.b_read_all.setEnabled(e)
@@ -54,27 +65,74 @@ class WidgetRegisterDisplay(QWidget):
         self.b_load_eeprom.setEnabled(e)
         self.register_entries.setEnabled(e)
 
+    def _read_all(self):
+        if self.register_entries.is_reading_all():
+            self.register_entries.cancel_read_all()
+        else:
+            self.register_entries.read_all()
+
+    def _read_all_busy(self, busy):
+        self.b_read_all.setText("Cancel" if busy else "Read all")
+
+    def select_model_number(self, model_number):
+        """ Shows the register map matching a device model number, if any """
+        register_map = self.catalog.byModelNumber(model_number)
+        if register_map is not None and register_map.name in self.reg_map_names:
+            self.reg_map_combobox.setCurrentIndex(
+                self.reg_map_names.index(register_map.name))
+
     def _update_reg_list(self, index):
-        self.register_entries.init(self.reg_map_list[index])
+        if not 0 <= index < len(self.reg_map_names):
+            return
+        register_map = self.catalog.get(self.reg_map_names[index])
+        if register_map is None:
+            return
+        self.register_entries.init(register_map)
+        self.register_map_changed.emit(self.register_entries.register_map)
         self.scroll_area.setFixedWidth(self.register_entries.width() + 25)
 
     def _save_eeprom(self):
         file_name, _ = QFileDialog.getSaveFileName(self, "Save EEPROM",
                                                 self.current_preset_dir,
-                                                "OW EEPROM (*.ow)")
-        if len(file_name) > 0:
-            self.current_preset_dir = dirname(file_name)
+                                                OW_PRESET_FILTERS)
+        if len(file_name) == 0:
+            return
+        self.current_preset_dir = dirname(file_name)
+        triples = self.register_entries.export_eeprom()
+        if file_name.endswith(".owb"):
+            if any(v is None for _, _, v in triples):
+                print("Cannot save an EEPROM image: some values are unknown")
+                return
+            try:
+                OneWirePresetImage.fromTriples(
+                    self.register_entries.register_map, triples).save(file_name)
+            except (OneWirePresetError, ValueError) as e:
+                print("Cannot save an EEPROM image:", e)
+        else:
             with open(file_name, 'w') as file:
-                json.dump(self.register_entries.export_eeprom(), file)
+                json.dump(triples, file)
 
     def _load_eeprom(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "Load EEPROM",
                                                    self.current_preset_dir,
-                                                   "OW EEPROM (*.ow)")
-        if len(file_name) > 0:
-            self.current_preset_dir = dirname(file_name)
-            with open(file_name, 'r') as file:
-                try:
-                    self.register_entries.import_eeprom(json.load(file))
-                except (ValueError, IndexError):
-                    pass
+                                                   OW_PRESET_FILTERS)
+        if len(file_name) == 0:
+            return
+        self.current_preset_dir = dirname(file_name)
+        try:
+            with open(file_name, 'rb') as file:
+                raw = file.read()
+            if raw.startswith(OW_PRESET_MAGIC):
+                image = OneWirePresetImage.fromBytes(raw)
+                if image.map_name != self.register_entries.register_map.name:
+                    if image.map_name in self.reg_map_names:
+                        self.reg_map_combobox.setCurrentIndex(
+                            self.reg_map_names.index(image.map_name))
+                    else:
+                        self.select_model_number(image.model_number)
+                triples = image.triples(self.register_entries.register_map)
+            else:
+                triples = parse_json_preset(raw)
+            self.register_entries.import_eeprom(triples)
+        except (OSError, OneWirePresetError, ValueError) as e:
+            print("Cannot load", file_name + ":", e)
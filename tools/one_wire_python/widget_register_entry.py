@@ -1,9 +1,10 @@
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import (QWidget, QPushButton, QLabel, QHBoxLayout,
                              QVBoxLayout)
 from functools import partial
 from input_field import InputField
 from one_wire_python import OneWireDataMissing
+from reg_map.reg_map import compile_register_map
 
 
 class WidgetRegisterEntry(QWidget):
@@ -60,9 +61,15 @@ class WidgetRegisterEntry(QWidget):
             l_name.setToolTip(docstring)
 
     def read(self):
+        """ :returns: the Future of the read request, or None """
+        return self.cb_read(self.address, self.set_device_value)
+
+    def set_device_value(self, value):
         try:
             try:
-                self.device_value = self.cb_read(self.address)
+                if value is None:
+                    raise OneWireDataMissing
+                self.device_value = value
                 self.field.set_value(self.device_value)
             except ValueError:
                 print("Value read from device at address", self.address,
@@ -76,9 +83,13 @@ class WidgetRegisterEntry(QWidget):
 
     def write(self):
         if self.b_write.isEnabled():
-            if self.cb_write(self.address, self.gui_value):
-                self.device_value = self.gui_value
-                self._update_boldness()
+            self.cb_write(self.address, self.gui_value,
+                          partial(self._write_done, self.gui_value))
+
+    def _write_done(self, value, success):
+        if success:
+            self.device_value = value
+            self._update_boldness()
 
     def set_gui_value(self, value):
         try:
@@ -108,11 +119,14 @@ class WidgetRegisterEntry(QWidget):
 
 
 class WidgetRegisterEntryList(QWidget):
-    def __init__(self, master, cbRead, cbWrite):
+    busy_changed = pyqtSignal(bool)  # a "Read all" started or ended
+
+    def __init__(self, master, cbRead, cbWrite, cbReadBlock=None):
         super().__init__(master)
         # Callbacks
         self.cb_read = cbRead
         self.cb_write = cbWrite
+        self.cb_read_block = cbReadBlock
 
         # Layout
         self.grid = QVBoxLayout()
@@ -120,16 +134,15 @@ class WidgetRegisterEntryList(QWidget):
         self.setLayout(self.grid)
 
         # Members
-        self.entries = []
-        self.addresses = []
-        self.sizes = []
-        self.eeprom_size = 0
+        self.entries = []  # one per register of register_map.registers
+        self.register_map = None
+        self._read_all_pending = []
 
     def init(self, register_map):
+        self.cancel_read_all()
+        register_map = compile_register_map(register_map)
         self.entries = []
-        self.addresses = []
-        self.sizes = []
-        self.eeprom_size = len(register_map[1])
+        self.register_map = register_map
         for i in reversed(range(self.grid.count())):
             item = self.grid.itemAt(i)
             w = item.widget()
@@ -154,37 +167,96 @@ class WidgetRegisterEntryList(QWidget):
         self.grid.addStretch(1)
 
     def read_all(self):
-        for entry in self.entries:
-            entry.read()
+        """ Sends the reads in the background, the entries are updated as
+            the answers arrive
+        """
+        self.cancel_read_all()
+        futures = []
+        if self.register_map is None:
+            return
+        if self.cb_read_block is None:
+            for entry, r in zip(self.entries, self.register_map.registers):
+                futures.append(self.cb_read(
+                    r.address, r.size,
+                    partial(self._read_all_done, entry.set_device_value)))
+        else:
+            eeprom_size = len(self.register_map.eeprom)
+            area_entries = (self.entries[:eeprom_size],
+                            self.entries[eeprom_size:])
+            for area, entries in zip(self.register_map[1:], area_entries):
+                if len(area) == 0:
+                    continue
+                futures.append(self.cb_read_block(
+                    area.start, area.length, partial(
+                        self._read_all_done,
+                        partial(self._set_area_values, area, entries))))
+        self._read_all_pending = [f for f in futures
+                                  if f is not None and not f.done()]
+        if len(self._read_all_pending) > 0:
+            self.busy_changed.emit(True)
+
+    def is_reading_all(self):
+        return len(self._read_all_pending) > 0
+
+    def cancel_read_all(self):
+        """ Drops the reads of "Read all" which have not been sent yet """
+        if len(self._read_all_pending) == 0:
+            return
+        for future in self._read_all_pending:
+            future.cancel()
+        self._read_all_pending = []
+        self.busy_changed.emit(False)
+
+    def _read_all_done(self, callback, value):
+        callback(value)
+        pending = [f for f in self._read_all_pending if not f.done()]
+        if len(self._read_all_pending) > 0 and len(pending) == 0:
+            self._read_all_pending = []
+            self.busy_changed.emit(False)
+        else:
+            self._read_all_pending = pending
+
+    @staticmethod
+    def _set_area_values(area, entries, data):
+        if data is None:
+            values = [None] * len(area)
+        else:
+            values = area.decode(data).values()
+        for entry, value in zip(entries, values):
+            entry.set_device_value(value)
 
     def export_eeprom(self):
         output = []
-        for i in range(self.eeprom_size):
-            output.append(
-                (self.addresses[i],
-                 self.sizes[i],
-                 self.entries[i].get_gui_value()))
+        for entry, r in zip(self.entries, self.register_map.eeprom):
+            output.append((r.address, r.size, entry.get_gui_value()))
         return output
 
     def import_eeprom(self, value_list):
-        i = 0
-        for entry in value_list:
-            if len(entry) != 3:
-                raise IndexError
-            if entry[0] != self.addresses[i]:
-                raise ValueError
-            if entry[1] != self.sizes[i]:
-                raise ValueError
-            self.entries[i].set_gui_value(entry[2])
-            i += 1
+        """ Sets the GUI values of the EEPROM registers from a list of
+            (address, size, value), matched by address. Nothing is set if an
+            entry does not match a register of the current map.
+        """
+        entries = {r.address: (r, e) for r, e in
+                   zip(self.register_map.eeprom, self.entries)}
+        values = []
+        for item in value_list:
+            if len(item) != 3:
+                raise ValueError("Invalid preset entry: " + str(item))
+            address, size, value = item
+            if address not in entries or entries[address][0].size != size:
+                raise ValueError("No register of size " + str(size) +
+                                 " at address " + str(address))
+            values.append((entries[address][1], value))
+        for entry, value in values:
+            entry.set_gui_value(value)
 
     #  Wrapper to make the use of 'partial' clearer
-    def _read(self, address, size):
-        return self.cb_read(address, size)
+    def _read(self, address, on_value, size):
+        return self.cb_read(address, size, on_value)
 
     #  Wrapper to make the use of 'partial' clearer
-    def _write(self, address, value, size):
-        return self.cb_write(address, size, value)
+    def _write(self, address, value, on_done, size):
+        return self.cb_write(address, size, value, on_done)
 
     def _add_reg_entry(self, reg_entry):
         r_cb = partial(self._read, size=reg_entry[1])
@@ -195,6 +267,4 @@ class WidgetRegisterEntryList(QWidget):
         w = WidgetRegisterEntry(self, reg_entry[0], reg_entry[4], reg_entry[5],
                                 reg_entry[2], r_cb, reg_entry[6], w_cb)
         self.entries.append(w)
-        self.addresses.append(reg_entry[0])
-        self.sizes.append(reg_entry[1])
         self.grid.addWidget(w)
@@ -75,9 +75,11 @@ class WidgetSerialPort(QWidget):
             self.scan_ports()
 
     def scan_ports(self):
-        for i in range(self.combo_box.count()):
-            self.combo_box.removeItem(i)
+        current = self.combo_box.currentText()
+        self.combo_box.clear()
         self.combo_box.addItems(self.cb_list_ports())
+        if len(current) > 0:
+            self.combo_box.setCurrentText(current)
 
     def get_current_port(self):
         strList = self.combo_box.currentText().split()